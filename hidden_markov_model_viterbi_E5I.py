@@ -19,6 +19,8 @@ Description:    The following program is a Viterbi algorithm implementation of t
                     trace matrix, created to indicate whether a state-to-state movment was done to arrive in the current probability matrix location.
                 Finally, using the trace matrix, program traces back the most likely path and using the probability matrix, determines the
                 probability of that path.
+                Both matrices are calculated by the ViterbiModel class described below, in log probabilities, so that long sequences do not
+                underflow to probability 0.
 
 Algorithm:      Input:  N = sequence of nucleotides
                         P(n|s) = initial probability of nucleotide in state s
@@ -48,11 +50,29 @@ Instructions:   To run the program,
                 2.    follow the on-screen instructions, inputing algorithm probability parameters;
                         if errors are encountered, they will display on screen;
                 3.    after prompt, enter a sequence of nucleotides;
-                4.    program will calculate and output the most likely path and the probability of that path;
+                4.    program will calculate and output the most likely path, as runs of each state, and the probability of that path;
+                        run the program with --matrix to also print the probability matrix (shown in the example below);
                 5.    after prompt,
                         type "Y" if you wish to try another sequence using current probability paramteres;
                         type "N" if you wish to exit;
 
+Library use:    The ViterbiModel class decodes sequences without prompting, working with log probabilities so that long sequences do not
+                underflow to 0. The sequence is encoded once into an array of integers and every row of the matrix is filled with NumPy.
+                    model = ViterbiModel.from_e5i(0.1, 0.5, 0.1, nucleotide_at_state)
+                    result = model.decode('TATAT')      # result.path = [0, 1, 2, 2, 2], indices into model.states
+                    result.segments                     # [(0, 0, 1), (1, 1, 2), (2, 2, 5)], runs of (state, start, end)
+                hmm_viterbi_output writes segments as BED, GFF3 or TSV and saves the matrix as a binary .npy file on request.
+                For chromosome-scale sequences, model.decode(sequence, low_memory=True) keeps one block of the matrix at a time and stores
+                the trace in about one bit per state and nucleotide; measure_memory=True reports the peak memory used while decoding.
+                For sequences that arrive continuously, model.decode_stream(chunks) reads pieces of the sequence from an iterable or a file
+                object and yields (state, start, end) segments of the path as soon as they can no longer change.
+                model.decode_parallel(sequence, processes=8) splits a single long sequence into chunks decoded on separate processes.
+                Other gene models are described as a graph of any number of states with a list of (from, to, probability) transitions,
+                start and end probabilities and an emission alphabet that may include ambiguous symbols such as N:
+                    model = ViterbiModel(states, transitions, emissions, start, end, ambiguous=DNA_AMBIGUITY)
+                model.instrument() turns on counters and timers of each decoding phase, readable at any time from model.stats;
+                hmm_viterbi_benchmark.py measures the decoder on synthetic sequences of growing length.
+
 Example:        Prompt                                                              Input
                 ----------------------------------------------------------------    ---------
         Input:  Enter the probability of starting in Exon state:                    >>> 1
@@ -74,28 +94,28 @@ Example:        Prompt
 
                 Enter a sequence of nucleotides (using only first letter for each nucleotide):  >>> tatat
                 Using Viterbi algorithm, the most probable state of TATAT is
-                Exon, 5 Prime, Intron, Intron, Intron,
-                with overall probability of 5.184000000000002e-05
+                Exon 1-1, 5 Prime 2-2, Intron 3-5
+                with overall probability of 5.1840000000000005e-05
                 --------------------------------------------------
                                       T                     A                     T                     A                     T
-                Exon                  0.25                  0.05625               0.01265625            0.0028476562500000004 0.0006407226562500001
-                5 Prime               0                     0.020000000000000004  0.0015000000000000002 0.0010125000000000002 7.593750000000001e-05
-                Intron                0                     0                     0.004000000000000001  0.0014400000000000003 0.0005184000000000001
+                Exon                  0.25                  0.05625               0.012656250000000004  0.002847656249999999  0.0006407226562499999
+                5 Prime               0.0                   0.02000000000000001   0.0015000000000000007 0.001012500000000001  7.593750000000013e-05
+                Intron                0.0                   0.0                   0.004000000000000002  0.0014399999999999999 0.0005184000000000001
                 --------------------------------------------------
 
                 Would you like to enter another sequence? (Y/N)                                 >>> y
                 Enter a sequence of nucleotides (using only first letter for each nucleotide):  >>> aatgt
                 Using Viterbi algorithm, the most probable state of AATGT is
-                Exon, 5 Prime, Intron, Intron, Intron,
-                with overall probability of 1.2960000000000005e-05
+                Exon 1-1, 5 Prime 2-2, Intron 3-5
+                with overall probability of 1.2960000000000022e-05
                 --------------------------------------------------
                                       A                     A                     T                     G                     T
-                Exon                  0.25                  0.05625               0.01265625            0.0028476562500000004 0.0006407226562500001
-                5 Prime               0                     0.020000000000000004  0.0015000000000000002 0.0                   4.271484375e-05
-                Intron                0                     0                     0.004000000000000001  0.0003600000000000001 0.00012960000000000003
+                Exon                  0.25                  0.05625               0.012656250000000004  0.002847656249999999  0.0006407226562499999
+                5 Prime               0.0                   0.02000000000000001   0.0015000000000000007 0.0                   4.2714843750000015e-05
+                Intron                0.0                   0.0                   0.004000000000000002  0.00036000000000000024 0.00012960000000000011
                 Using Viterbi algorithm, the most probable state of AATGT is
-                Exon, 5 Prime, Intron, Intron, Intron,
-                with overall probability of 1.2960000000000005e-05
+                Exon 1-1, 5 Prime 2-2, Intron 3-5
+                with overall probability of 1.2960000000000022e-05
 
                 Would you like to enter another sequence? (Y/N)                                 >>> y
                 Enter a sequence of nucleotides (using only first letter for each nucleotide):  >>> aga
@@ -103,13 +123,777 @@ Example:        Prompt
 
                 Would you like to enter another sequence? (Y/N)                                 >>> n
 '''
+import os
+import sys
+import tracemalloc
+from collections import Counter, namedtuple
+from contextlib import contextmanager, nullcontext
+from multiprocessing import Pool
 from re import match
+from time import perf_counter
 
-class Viterbi:
+import numpy as np
+
+NUCLEOTIDES = 'ACGT'  #order of nucleotide codes 0-3 used by the NumPy engine
+INVALID_CODE = 255  #code given to any byte that is not a nucleotide
+BASE_CODES = np.full(256, INVALID_CODE, dtype=np.uint8)  #translation table from ASCII byte to nucleotide code
+for _code, _base in enumerate(NUCLEOTIDES):
+    BASE_CODES[ord(_base)] = BASE_CODES[ord(_base.lower())] = _code
+DNA_AMBIGUITY = {'N': 'ACGT'}  #ambiguous symbol standing for any nucleotide; pass IUPAC codes such as {'R': 'AG'} to ViterbiModel as needed
+MAX_STATES = 127  #back-pointers are stored as int8
+BLOCK_SIZE = 1 << 16  #number of columns filled per NumPy pass; bounds temporaries and cumulative-sum rounding
+START = -1  #trace value marking the first column of a path
+TIE_TOLERANCE = 1e-12  #relative difference below which moving into a state and remaining in it count as equally probable
+
+
+
+class ViterbiResult(namedtuple('ViterbiResult', ['path', 'log_probability', 'matrix', 'trace', 'peak_memory'], defaults=(None,))):
+    """Result of ViterbiModel.decode(): path of state indices (None if no probable path exists), its log probability, the matrices
+       when they were kept, and the peak memory when it was measured.
+    """
+    __slots__ = ()
+
+    @property
+    def segments(self):
+        """The path as a list of (state index, start, end) runs, 0-based with end excluded; see path_segments()."""
+        return path_segments(self.path)
+
+
+def path_segments(path, offset=0):
+    """Run-length encodes a path of state indices into (state index, start, end) tuples, 0-based with end excluded, adding offset
+       to the positions. The runs are found with one vectorized comparison of neighbouring states.
+    """
+    if path is None or not len(path):
+        return []
+    starts = np.concatenate(([0], np.flatnonzero(path[1:] != path[:-1]) + 1))  #columns where the state changes
+    ends = np.append(starts[1:], len(path))
+    return [(int(path[start]), offset + int(start), offset + int(end)) for start, end in zip(starts, ends)]
+
+
+def symbol_table(symbols):
+    """Builds a translation table from ASCII byte to code, giving each symbol its position in symbols; letters are accepted in either case."""
+    table = np.full(256, INVALID_CODE, dtype=np.uint8)
+    for code, symbol in enumerate(symbols):
+        table[ord(symbol.upper())] = table[ord(symbol.lower())] = code
+    return table
+
+
+def encode_sequence(sequence, table=BASE_CODES):
+    """Converts a nucleotide string or bytes into a uint8 array of codes with a single translation-table pass (by default 0-3 for A, C, G, T).
+       Lower case letters are accepted; any other character raises ValueError. Arrays that are already encoded are returned unchanged.
+    """
+    if isinstance(sequence, np.ndarray):  #already encoded, e.g. a view handed over by a reader
+        return sequence
+    if isinstance(sequence, str):
+        try:
+            sequence = sequence.encode('ascii')
+        except UnicodeEncodeError:
+            raise ValueError(_invalid_symbols(table)) from None
+    return validate_codes(table[np.frombuffer(sequence, dtype=np.uint8)], table)  #one fancy-indexing pass over the raw bytes
+
+
+def validate_codes(codes, table=BASE_CODES):
+    """Returns codes produced with a translation table, raising ValueError if any came from a character outside its alphabet."""
+    if (codes == INVALID_CODE).any():
+        raise ValueError(_invalid_symbols(table))
+    return codes
+
+
+def _invalid_symbols(table):
+    """Error message listing the characters accepted by a translation table."""
+    symbols = [chr(byte) for byte in range(256) if table[byte] != INVALID_CODE and not chr(byte).islower()]
+    return 'Sequence may only contain {} characters.'.format(', '.join(symbols[:-1]) + ', or ' + symbols[-1] if len(symbols) > 1 else symbols[0])
+
+
+def encoded_chunks(source, size=BLOCK_SIZE, table=BASE_CODES):
+    """Yields encoded arrays for nucleotides arriving in pieces: an iterable of strings, bytes or encoded arrays, or a file object that
+       is read size characters at a time. Whitespace such as line breaks between pieces is ignored.
+    """
+    if hasattr(source, 'read'):
+        read = source.read
+        source = iter(lambda: read(size), read(0))  #stops at the empty string or bytes returned at end of file
+    for chunk in source:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('ascii', errors='replace')  #non-ASCII characters become '?' and are rejected by encode_sequence()
+        if isinstance(chunk, (bytes, bytearray)):
+            chunk = chunk.translate(None, b' \t\r\n')
+        codes = encode_sequence(chunk, table)
+        if len(codes):
+            yield codes
+
+
+def _log(probabilities):
+    """Returns natural logarithms of an array of probabilities, mapping probability 0 to -inf without a warning."""
+    with np.errstate(divide='ignore'):
+        return np.log(np.asarray(probabilities, dtype=np.float64))
+
+
+def _with_tie_slack(values):
+    """Raises finite log probabilities by TIE_TOLERANCE of their size, so that moves only win when more probable beyond rounding."""
+    return values + np.where(np.isfinite(values), TIE_TOLERANCE * np.abs(values), 0.0)
+
+
+def _best_state(scores):
+    """Returns the first state whose score is within TIE_TOLERANCE of the best, so that rounding does not decide between ties."""
+    return int(np.argmax(_with_tie_slack(scores) >= scores.max()))
+
+
+def _segmented_running_max(values, segments):
+    """Running maximum of values that restarts whenever the (non-decreasing) segment number changes.
+       Each value is replaced by its rank so that the segment number can be placed in front of it in a single integer key.
+    """
+    order = np.argsort(values, kind='stable')
+    rank = np.empty(len(values), dtype=np.int64)
+    rank[order] = np.arange(len(values))
+    offset = segments.astype(np.int64) * len(values)  #keys of a later segment are always larger than keys of an earlier one
+    return values[order[np.maximum.accumulate(offset + rank) - offset]]
+
+
+def _commit_segments(path, offset, segment):
+    """Splits a committed piece of path starting at column offset into (state, start, end) segments, extending the held segment
+       if it continues in the same state. Returns the finished segments and the last one, which is held back since the next piece may extend it.
+    """
+    finished = []
+    for state, start, end in path_segments(path, offset):
+        if segment is not None and segment[0] == state and segment[2] == start:
+            segment = (state, segment[1], end)
+        else:
+            if segment is not None:
+                finished.append(segment)
+            segment = (state, start, end)
+    return finished, segment
+
+
+def _no_path_message(forced):
+    """Error message of ViterbiModel.decode_stream() when no path is left, telling apart paths dropped by a forced commit."""
+    if forced:
+        return 'No probable path agrees with the segments committed after max_lag columns; decode with a larger max_lag or max_lag=None.'
+    return 'No probable path exists.'
+
+
+def _chunk_transfer(task):
+    """Worker for ViterbiModel.decode_parallel(): returns the transfer matrix of one chunk, one row per state before the chunk.
+       Each row only fills the states that can be reached from its state, the others staying at -inf.
+       The first chunk has nothing before it and is filled from Start, with its trace; it returns its last column as a single row
+       and its CompactTrace, so that it needs no second pass.
+    """
+    model, codes, first_chunk = task
+    if first_chunk:
+        last_column, trace, _ = model.build_compact_trace(codes)
+        return last_column[None, :], trace
+    transfer = np.empty((len(model.states), len(model.states)), dtype=np.float64)
+    for state in range(len(model.states)):
+        previous = np.full(len(model.states), -np.inf)
+        previous[state] = 0.0  #all paths leave from this state
+        transfer[state] = model._last_column(codes, previous, model.reachable[state])
+    return transfer, None
+
+
+def _chunk_trace(task):
+    """Worker for ViterbiModel.decode_parallel(): fills one chunk from the score column entering it (None for the first chunk) and
+       returns its last column and CompactTrace, the same trace decode() fills for those columns.
+    """
+    model, codes, previous = task
+    last_column, trace, _ = model.build_compact_trace(codes, previous=previous)
+    return last_column, trace
+
+
+class DecoderStats:
+    """Counters and timers collected by a ViterbiModel while instrumentation is on; see ViterbiModel.instrument().
+       counters: sequences, bases and cells (states x bases) decoded, blocks filled, and sequences without a probable path
+       seconds:  total time spent in each phase (encode, fill, traceback, and for decode_stream()/decode_parallel() their own phases;
+                 ingest for records read from files by hmm_viterbi_batch.read_sequence_file())
+       last:     seconds spent in each phase by the latest sequence, to see where time goes record by record
+    """
     def __init__(self):
+        self.counters = Counter()
+        self.seconds = Counter()
+        self.last = {}
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager adding the time spent inside it to the named phase."""
+        began = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - began
+            self.seconds[name] += elapsed
+            self.last[name] = elapsed
+
+    def as_dict(self):
+        """Returns the counters and timers as plain dictionaries, e.g. for logging as JSON."""
+        return {'counters': dict(self.counters), 'seconds': dict(self.seconds), 'last': dict(self.last)}
+
+
+class CompactTrace:
+    """Trace matrix stored in one bit per state and column, for decoding sequences too long for the int8 trace of build_matrix().
+       entered[q] is a bit-packed row with a 1 in every column where the path in state q arrived from another state (or from Start).
+       Which state that was is implied for states with a single predecessor; it is kept in sources[q] only for states with several.
+       A trace that continues an earlier piece of sequence (see ViterbiModel.decode_parallel()) may have paths that entered their state
+       before its first column; their rows have no 1 at or before the column being traced.
+    """
+    def __init__(self, n, edge_start, edge_source, continued=False):
+        self.n = n
+        self.continued = continued  #the first column continues an earlier piece of sequence instead of starting from Start
+        counts = np.diff(edge_start)  #number of predecessors of each state
+        self.entered = np.zeros((len(counts), (n + 7) // 8), dtype=np.uint8)
+        self.predecessor = [int(edge_source[edge_start[q]]) if count == 1 else START for q, count in enumerate(counts)]  #the only state each state can be entered from
+        self.sources = {q: np.empty(n, dtype=np.int8) for q, count in enumerate(counts) if count > 1}
+
+    @property
+    def nbytes(self):
+        """Memory used by the stored trace, in bytes."""
+        return self.entered.nbytes + sum(sources.nbytes for sources in self.sources.values())
+
+    def store(self, first, trace):
+        """Packs a block of the int8 trace matrix that starts at column first, which must be a multiple of 8."""
+        moved = trace != np.arange(len(trace), dtype=np.int8)[:, None]  #columns where each state was entered from elsewhere
+        packed = np.packbits(moved, axis=1, bitorder='little')
+        self.entered[:, first // 8:first // 8 + packed.shape[1]] = packed
+        for q, sources in self.sources.items():
+            sources[first:first + trace.shape[1]] = trace[q]
+
+    def last_entry(self, state, i):
+        """Returns the last column at or before column i where the path in state entered it, scanning the packed row backwards."""
+        row = self.entered[state]
+        byte = i >> 3
+        head = int(row[byte]) & ((2 << (i & 7)) - 1)  #bits of the columns up to and including i in the byte holding column i
+        while not head:
+            if byte == 0:  #entered before the first column of a continued trace
+                return 0
+            first = max(0, byte - BLOCK_SIZE // 8)
+            set_bytes = np.flatnonzero(row[first:byte])
+            byte = first + (int(set_bytes[-1]) if len(set_bytes) else 0)
+            head = int(row[byte])
+        return (byte << 3) + head.bit_length() - 1
+
+    def source(self, state, column):
+        """Returns the state the path came from when it entered state at column, or START in the first column.
+           In the first column of a continued trace it is the state before that column, which is state itself if the path stayed in it.
+        """
+        if column == 0:
+            if not self.continued:
+                return START
+            if not self.entered[state, 0] & 1:
+                return state
+        if state in self.sources:
+            return int(self.sources[state][column])
+        return self.predecessor[state]
+
+
+class ViterbiModel:
+    """Non-interactive hidden Markov model decoded with the Viterbi algorithm in log space.
+
+       states:      list of state names
+       transitions: list of (from state, to state, probability) edges, with states given by name or index; missing edges have probability 0
+       emissions:   {state: {symbol: probability}} dictionary, or a states x symbols array in the order of alphabet
+       start:       {state: probability} of the first symbol being in each state, or an array with one value per state
+       end:         {state: probability} of moving to End after the last symbol, or an array with one value per state
+       alphabet:    emitted symbols, by default the nucleotides A, C, G, T
+       ambiguous:   {symbol: alphabet symbols it may stand for}, such as DNA_AMBIGUITY; the emission probability of an ambiguous
+                    symbol is the sum of the probabilities of the symbols it stands for
+
+       The graph is compiled into arrays: log probabilities of staying in each state, the other incoming edges of every state as
+       predecessor lists in compressed sparse row form (edges edge_start[q] to edge_start[q + 1] - 1 lead into state q), and a log
+       emission table indexed by symbol code. The inner loops only visit these edges.
+       If the states form a left-to-right graph apart from self-transitions, as Exon -> 5' -> Intron does, every row of the matrix is
+       filled in one NumPy pass over a block of the sequence, in the same row-by-row order as the Algorithm above; graphs with
+       cycles, such as gene models that return from an intron to an exon, are filled one column at a time.
+    """
+    def __init__(self, states, transitions, emissions, start, end, alphabet=NUCLEOTIDES, ambiguous=None):
+        self.states = list(states)
+        count = len(self.states)
+        if count > MAX_STATES:
+            raise ValueError('A model may have at most {} states.'.format(MAX_STATES))
+        index = {name: number for number, name in enumerate(self.states)}
+
+        def state_number(state):
+            return index[state] if state in index else int(state)
+
+        self.alphabet = alphabet
+        self.symbols = alphabet + ''.join(ambiguous or {})  #symbol of each code; ambiguous symbols follow the alphabet
+        self.symbol_codes = symbol_table(self.symbols)
+        if isinstance(emissions, dict):
+            emissions = [[emissions[state].get(symbol, 0) for symbol in alphabet] for state in self.states]
+        emissions = np.asarray(emissions, dtype=np.float64)
+        if emissions.shape != (count, len(alphabet)):
+            raise ValueError('Expected a {}x{} emission array.'.format(count, len(alphabet)))
+        expanded = [emissions[:, [alphabet.index(symbol) for symbol in meaning]].sum(axis=1) for meaning in (ambiguous or {}).values()]
+        self.log_emissions = _log(np.column_stack([emissions] + expanded))  #states x codes lookup table
+
+        self.log_start = _log(self._per_state(start, state_number))
+        self.log_end = _log(self._per_state(end, state_number))
+        self.log_stay = np.full(count, -np.inf)  #probability of remaining in each state
+        edges = {}
+        for source, target, probability in transitions:
+            source, target = state_number(source), state_number(target)
+            if not 0 <= source < count or not 0 <= target < count:
+                raise ValueError('Transition ({}, {}) refers to an unknown state.'.format(source, target))
+            if probability <= 0:
+                continue
+            if source == target:
+                self.log_stay[source] = np.log(probability)
+            else:
+                edges[target, source] = np.log(probability)
+        ordered = sorted(edges)  #grouped by target state, then by source state
+        self.edge_source = np.array([source for _, source in ordered], dtype=np.intp)
+        self.edge_log = np.array([edges[edge] for edge in ordered], dtype=np.float64)
+        self.edge_start = np.searchsorted([target for target, _ in ordered], np.arange(count + 1)).astype(np.intp)
+        self.order = self._row_order()
+        self.reachable = self._reachable_states()
+        self.stats = None  #DecoderStats while instrumentation is on
+        if self.order is None:
+            targets = np.flatnonzero(np.diff(self.edge_start))  #states with at least one incoming edge
+            self._targets = targets
+            self._group_starts = self.edge_start[targets]
+            self._group_sizes = np.diff(self.edge_start)[targets]
+
+    def _per_state(self, values, state_number):
+        """Returns an array with one value per state from a {state: value} dictionary or a sequence of values."""
+        if isinstance(values, dict):
+            result = np.zeros(len(self.states))
+            for state, value in values.items():
+                result[state_number(state)] = value
+            return result
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape != (len(self.states),):
+            raise ValueError('Expected one start and end probability per state.')
+        return values
+
+    @classmethod
+    def from_matrix(cls, states, transitions, emissions, start, end, alphabet=NUCLEOTIDES, ambiguous=None):
+        """Builds a model from a dense states x states transition array, transitions[i][j] = probability of moving from state i into state j."""
+        edges = [(i, j, probability) for (i, j), probability in np.ndenumerate(np.asarray(transitions, dtype=np.float64)) if probability > 0]
+        return cls(states, edges, emissions, start, end, alphabet, ambiguous)
+
+    @classmethod
+    def from_e5i(cls, exon_to_5prime, five_prime_to_intron, intron_to_end, nucleotide_at_state, ambiguous=None):
+        """Builds the Exon -> 5' -> Intron model from the same parameters requested by the interactive program.
+           nucleotide_at_state is a dictionary of the form {state: {nucleotide: probability}}, as in Viterbi.nucleotide_at_state.
+        """
+        transitions = [('Exon', 'Exon', 1 - exon_to_5prime), ('Exon', '5 Prime', exon_to_5prime),
+                       ('5 Prime', '5 Prime', 1 - five_prime_to_intron), ('5 Prime', 'Intron', five_prime_to_intron),
+                       ('Intron', 'Intron', 1 - intron_to_end)]
+        return cls(['Exon', '5 Prime', 'Intron'], transitions, nucleotide_at_state, start={'Exon': 1}, end={'Intron': intron_to_end},
+                   ambiguous=ambiguous)
+
+    def _row_order(self):
+        """Orders the states so that every state comes after all of its predecessors, or returns None if the graph has a cycle."""
+        order, placed = [], np.zeros(len(self.states), dtype=bool)
+        while len(order) < len(self.states):
+            ready = [q for q in range(len(self.states))
+                     if not placed[q] and placed[self.edge_source[self.edge_start[q]:self.edge_start[q + 1]]].all()]
+            if not ready:
+                return None
+            order.extend(ready)
+            placed[ready] = True
+        return order
+
+    def _reachable_states(self):
+        """Returns, for every state, a boolean array of the states a path starting in it can reach, itself included."""
+        adjacency = np.zeros((len(self.states), len(self.states)), dtype=np.int64)
+        adjacency[self.edge_source, np.repeat(np.arange(len(self.states)), np.diff(self.edge_start))] = 1  #adjacency[from, to]
+        reachable = np.eye(len(self.states), dtype=bool)
+        while True:  #one more step along the edges each time, until no new state is reached
+            grown = reachable | (reachable.astype(np.int64) @ adjacency > 0)
+            if np.array_equal(grown, reachable):
+                return reachable
+            reachable = grown
+
+    def instrument(self, enabled=True):
+        """Turns the collection of counters and timers on (with a fresh DecoderStats, which is returned) or off.
+           Instrumentation costs one check per phase and block when off, and two clock readings per phase when on.
+        """
+        self.stats = DecoderStats() if enabled else None
+        return self.stats
+
+    def _phase(self, name):
+        """Times the named phase if instrumentation is on."""
+        return self.stats.phase(name) if self.stats is not None else nullcontext()
+
+    def encode(self, sequence):
+        """Encodes a sequence once into an array of symbol codes of this model; see encode_sequence()."""
+        return encode_sequence(sequence, self.symbol_codes)
+
+    def decode(self, sequence, low_memory=False, keep_matrix=False, measure_memory=False):
+        """Finds the most probable path of states for a sequence and its log probability.
+           Returns a ViterbiResult whose path is an array of state indices (None if no probable path exists).
+
+           low_memory=True keeps only one block of scores at a time and stores the trace in a CompactTrace (about 3 bits per nucleotide
+           for Exon, 5', Intron instead of 27 bytes), giving the same path; the matrix is then only kept if keep_matrix=True.
+           measure_memory=True reports the peak memory allocated while decoding, in bytes, as peak_memory. If tracemalloc is already
+           tracing, its peak is left as it is and peak_memory is an upper bound: the traced peak minus the memory in use before decoding.
+        """
+        if measure_memory:
+            tracing = tracemalloc.is_tracing()
+            if not tracing:
+                tracemalloc.start()  #the peak of a new trace starts here; a trace of the caller keeps its own peak
+            baseline = tracemalloc.get_traced_memory()[0]
+            try:
+                result = self.decode(sequence, low_memory, keep_matrix)
+                return result._replace(peak_memory=tracemalloc.get_traced_memory()[1] - baseline)
+            finally:
+                if not tracing:
+                    tracemalloc.stop()
+
+        with self._phase('encode'):
+            codes = self.encode(sequence)
+        with self._phase('fill'):
+            if low_memory:
+                last_column, trace, matrix = self.build_compact_trace(codes, keep_matrix)
+            else:
+                matrix, trace = self.build_matrix(codes)
+        with self._phase('traceback'):
+            if low_memory:
+                path, log_probability = self.compact_traceback(last_column, trace)
+            else:
+                path, log_probability = self.traceback(matrix, trace)
+        self._count_sequence(len(codes), path)
+        return ViterbiResult(path, log_probability, matrix, trace)
+
+    def _count_sequence(self, n, path):
+        """Counts a decoded sequence if instrumentation is on."""
+        if self.stats is not None:
+            self.stats.count('sequences')
+            self.stats.count('bases', n)
+            self.stats.count('cells', n * len(self.states))
+            if path is None:
+                self.stats.count('no_path')
+
+    def decode_stream(self, chunks, max_lag=1 << 20):
+        """Decodes nucleotides as they arrive (see encoded_chunks()), yielding finished segments of the most probable path as
+           (state index, start, end) tuples, 0-based with end excluded. Raises ValueError if no probable path exists.
+
+           Columns are committed once the paths ending in every still-possible state agree on them, which for Exon -> 5' -> Intron
+           happens as soon as the 5' and Intron paths share the Exon prefix of the Exon path. Agreement is checked between blocks of
+           BLOCK_SIZE nucleotides, however large the pieces read from chunks are, each time the uncommitted columns have grown by half.
+           Once more than max_lag columns are uncommitted they are checked after every block: if the paths still do not agree, the
+           path of the currently most probable state is committed up to max_lag columns back and decoding continues only among paths
+           that agree with it. So at most max_lag + BLOCK_SIZE columns of trace are held, and no column is committed later than that.
+           max_lag=None waits for agreement however long it takes. A path dropped by such a forced commit may have been the only one to reach End; the ValueError then says so.
+        """
+        count = len(self.states)
+        window = np.empty((count, BLOCK_SIZE), dtype=np.int8)  #trace columns not yet committed, the first one being column offset
+        offset = length = checked = 0
+        previous = None  #score column of the last nucleotide read
+        segment = None  #last committed segment, held back until the state changes
+        forced = False  #whether a forced commit has dropped paths
+        for codes in encoded_chunks(chunks, table=self.symbol_codes):
+            for first in range(0, len(codes), BLOCK_SIZE):
+                block = codes[first:first + BLOCK_SIZE]
+                with self._phase('fill'):
+                    if length + len(block) > window.shape[1]:
+                        size = 2 * length + len(block)  #doubles, so that copying stays linear
+                        if max_lag is not None:
+                            size = max(length + len(block), min(size, max_lag + 1 + BLOCK_SIZE))  #never more than max_lag ever holds
+                        window = np.concatenate((window[:, :length], np.empty((count, size - length), dtype=np.int8)), axis=1)
+                    scores = np.empty((count, len(block)), dtype=np.float64)
+                    self._fill_columns(block, 0, len(block), previous, scores, window[:, length:length + len(block)])
+                    previous = scores[:, -1].copy()
+                    length += len(block)
+                if 2 * (length - checked) < checked and (max_lag is None or length - 1 <= max_lag):
+                    continue  #checks again only once the window has grown by half, so checking stays linear, or once max_lag is passed
+                checked = length
+                alive = np.flatnonzero(previous > -np.inf)  #states some path can still be in
+                if not len(alive):
+                    raise ValueError(_no_path_message(forced))
+                with self._phase('agreement'):
+                    paths = self._window_paths(window[:, :length], alive)
+                    agree = np.all(paths == paths[0], axis=0)  #paths in the same state at a column share everything before it
+                    merged = length - 1 - int(np.argmax(agree[::-1])) if agree.any() else -1
+                if max_lag is not None and length - 1 - merged > max_lag:
+                    merged = length - 1 - max_lag
+                    best = int(np.argmax(previous[alive]))
+                    dropped = alive[paths[:, merged] != paths[best, merged]]
+                    previous[dropped] = -np.inf  #drops paths that disagree with the committed one
+                    forced = forced or len(dropped) > 0
+                    paths = paths[best:best + 1]
+                    if self.stats is not None:
+                        self.stats.count('forced_commits')
+                if merged < 0:
+                    continue
+                finished, segment = _commit_segments(paths[0, :merged + 1], offset, segment)
+                yield from finished
+                window[:, :length - merged - 1] = window[:, merged + 1:length]
+                offset, length = offset + merged + 1, length - merged - 1
+                checked = length
+
+        if previous is None:
+            return
+        final = previous + self.log_end
+        if final.max() == -np.inf:
+            raise ValueError(_no_path_message(forced))
+        finished, segment = _commit_segments(self._window_paths(window[:, :length], [_best_state(final)])[0], offset, segment)
+        self._count_sequence(offset + length, segment)
+        yield from finished
+        yield segment
+
+    def _window_paths(self, trace, states):
+        """Traces back the path ending in each of the given states through a window of trace columns, stopping at its first column."""
+        entries = [np.flatnonzero(trace[q] != q) for q in range(len(self.states))]  #columns where a path entered each state
+        paths = np.empty((len(states), trace.shape[1]), dtype=np.int8)
+        for path, state in zip(paths, states):
+            i = trace.shape[1] - 1
+            while i >= 0:
+                k = np.searchsorted(entries[state], i, side='right') - 1
+                entered = int(entries[state][k]) if k >= 0 else 0  #the path may have stayed in this state since before the window
+                path[entered:i + 1] = state
+                state, i = int(trace[state, entered]), entered - 1
+        return paths
+
+    def decode_parallel(self, sequence, processes=None, chunks=None, pool=None):
+        """Decodes one long sequence on several processes and returns the same ViterbiResult as decode(), without the matrices.
+
+           The sequence is cut into chunks (default: one per process, in whole blocks of BLOCK_SIZE). In a first parallel pass every chunk
+           computes its transfer matrix T, where T[s][t] is the log probability of the best way through the chunk from state s before it
+           to state t at its end. Chaining the chunks with max-plus products v[t] = max over s of (v[s] + T[s][t]) gives the score
+           entering each chunk. The first chunk keeps its trace from the first pass; a second parallel pass fills every other chunk
+           again from the column entering it, giving the trace decode() fills for the same columns, stored as a CompactTrace. The path
+           is traced back through these traces from the last chunk to the first, so it is the path of decode(), ties included: moves
+           within TIE_TOLERANCE of each other are ties in both, whatever the rounding of the entering columns.
+           The first pass fills each chunk once per state before it, restricted to the states reachable from that state (only Intron
+           from Intron), so up to states + 1 times the work of decode() is done; it only pays off with more processes than that, on as
+           many cores, and rarely for models with dozens of states that can all reach each other.
+           An existing multiprocessing pool may be passed in to avoid starting new processes; chunks then defaults to processes.
+        """
+        with self._phase('encode'):
+            codes = self.encode(sequence)
+        n = len(codes)
+        processes = processes or os.cpu_count()
+        blocks = -(-n // BLOCK_SIZE)
+        size = BLOCK_SIZE * -(-blocks // (chunks or processes)) if n else 1  #chunk length in whole blocks, keeping block boundaries of decode()
+        bounds = [(first, min(first + size, n)) for first in range(0, n, size)]
+        if len(bounds) <= 1:
+            with self._phase('fill'):
+                matrix, trace = self.build_matrix(codes)
+            with self._phase('traceback'):
+                path, log_probability = self.traceback(matrix, trace)
+            self._count_sequence(n, path)
+            return ViterbiResult(path, log_probability, None, None)
+
+        own_pool = pool is None
+        if own_pool:
+            pool = Pool(min(processes, len(bounds)))
+        try:
+            with self._phase('transfer'):
+                transfers, first_trace = zip(*pool.map(_chunk_transfer, [(self, codes[first:last], first == 0) for first, last in bounds]))
+            entering = [None]  #score column before each chunk; the first chunk starts from Start
+            for transfer in transfers[:-1]:
+                entering.append(transfer[0] if entering[-1] is None else np.max(entering[-1][:, None] + transfer, axis=0))
+            if (np.max(entering[-1][:, None] + transfers[-1], axis=0) + self.log_end).max() == -np.inf:
+                self._count_sequence(n, None)
+                return ViterbiResult(None, -np.inf, None, None)
+            with self._phase('fill'):
+                traces = [(transfers[0][0], first_trace[0])] + pool.map(
+                    _chunk_trace, [(self, codes[first:last], before) for (first, last), before in zip(bounds[1:], entering[1:])])
+        finally:
+            if own_pool:
+                pool.close()
+                pool.join()
+
+        with self._phase('traceback'):
+            final = traces[-1][0] + self.log_end
+            state = _best_state(final)
+            log_probability = float(final[state])
+            pieces = []
+            for _, trace in reversed(traces):  #the state before each chunk is the state at the end of the chunk before it
+                piece, state = self._compact_path(trace, state)
+                pieces.append(piece)
+        path = np.concatenate(pieces[::-1])
+        self._count_sequence(n, path)
+        return ViterbiResult(path, log_probability, None, None)
+
+    def _last_column(self, codes, previous, rows=None):
+        """Fills the matrix of a piece of sequence one reusable block at a time and returns only its last column.
+           rows, a boolean array with one value per state, restricts the fill to the states that can be reached (see _fill_by_row()).
+        """
+        scores = np.empty((len(self.states), min(len(codes), BLOCK_SIZE)), dtype=np.float64)
+        directions = np.empty(scores.shape, dtype=np.int8)
+        for first in range(0, len(codes), BLOCK_SIZE):
+            last = min(first + BLOCK_SIZE, len(codes))
+            self._fill_columns(codes, first, last, previous, scores[:, :last - first], directions[:, :last - first], rows)
+            previous = scores[:, last - first - 1].copy()
+        return previous
+
+    def build_matrix(self, codes, previous=None):
+        """Calculates the log probability and trace matrices for an encoded sequence.
+           trace[q][i] holds the state the path came from when in state q at column i, or START in the first column.
+           previous is the score column before the sequence when it continues another one; by default the sequence starts from Start.
+        """
+        n = len(codes)
+        matrix = np.empty((len(self.states), n), dtype=np.float64)
+        trace = np.empty((len(self.states), n), dtype=np.int8)
+        for first in range(0, n, BLOCK_SIZE):
+            last = min(first + BLOCK_SIZE, n)
+            self._fill_columns(codes, first, last, previous, matrix[:, first:last], trace[:, first:last])
+            previous = matrix[:, last - 1]
+        return matrix, trace
+
+    def build_compact_trace(self, codes, keep_matrix=False, previous=None):
+        """Low-memory version of build_matrix(): fills the same blocks but keeps only the latest one, packing its trace into a CompactTrace.
+           Returns (last column of the matrix, CompactTrace, full matrix if keep_matrix is True else None).
+           previous is the score column before the sequence when it continues another one, as in build_matrix().
+        """
+        n = len(codes)
+        trace = CompactTrace(n, self.edge_start, self.edge_source, continued=previous is not None)
+        matrix = np.empty((len(self.states), n), dtype=np.float64) if keep_matrix else None
+        scores = np.empty((len(self.states), min(n, BLOCK_SIZE)), dtype=np.float64)  #one reusable block of scores
+        directions = np.empty(scores.shape, dtype=np.int8)  #one reusable block of the trace matrix
+        for first in range(0, n, BLOCK_SIZE):
+            last = min(first + BLOCK_SIZE, n)
+            block = matrix[:, first:last] if keep_matrix else scores[:, :last - first]
+            self._fill_columns(codes, first, last, previous, block, directions[:, :last - first])
+            trace.store(first, directions[:, :last - first])
+            previous = block[:, -1].copy()
+        return previous, trace, matrix
+
+    def _fill_columns(self, codes, first, last, previous, matrix, trace, rows=None):
+        """Fills columns first to last - 1 into the matrix and trace blocks, given the score column before them (None at the start)."""
+        if self.stats is not None:
+            self.stats.count('blocks')
+        if previous is None:
+            matrix[:, 0] = self.log_start + self.log_emissions[:, codes[0]]  #first column is the probability of starting in each state
+            trace[:, 0] = START
+            previous, matrix, trace, first = matrix[:, 0], matrix[:, 1:], trace[:, 1:], 1
+        if first < last:
+            emission = self.log_emissions[:, codes[first:last]]  #emission lookup for the whole block with fancy indexing
+            self._fill_block(previous, emission, matrix, trace, rows)
+
+    def _fill_block(self, previous, emission, matrix, trace, rows=None):
+        """Fills one block of columns given the score column that precedes it, by rows for left-to-right graphs and by columns otherwise."""
+        if self.order is None:
+            self._fill_by_column(previous, emission, matrix, trace)
+        else:
+            self._fill_by_row(previous, emission, matrix, trace, rows)
+
+    def _fill_by_row(self, previous, emission, matrix, trace, rows=None):
+        """Fills one block of columns given the score column that precedes it, one state (row) at a time.
+
+           For a state q with self-transition s and prefix sums P(i) = sum of (e(k) + s) for k <= i, the recurrence
+           M(q,i) = e(i) + max(M(q,i-1) + s, incoming(i)) becomes H(i) = max(H(i-1), incoming(i) - s - P(i-1)) with H = M - P,
+           which is a running maximum computed by np.maximum.accumulate. A nucleotide that cannot occur in the state restarts the maximum.
+           The prefix sums round differently from the column-by-column recurrence, so the trace is decided afterwards by comparing the
+           move into q with M(q,i-1) + s directly; moves within TIE_TOLERANCE of remaining in q count as ties, which remain in q.
+           If rows is given, only the states marked in it are filled; the others must be unreachable and are set to -inf with no trace.
+        """
+        width = emission.shape[1]
+        order = self.order
+        if rows is not None:
+            matrix[~rows] = -np.inf
+            order = [q for q in order if rows[q]]
+        for q in order:
+            incoming = np.full(width, -np.inf)  #best probability of moving into q from another state
+            source = np.int8(q)
+            for edge in range(self.edge_start[q], self.edge_start[q + 1]):
+                p = self.edge_source[edge]
+                moved = np.empty(width)
+                moved[0] = previous[p]
+                moved[1:] = matrix[p, :-1]
+                moved += self.edge_log[edge]
+                better = moved > _with_tie_slack(incoming)
+                incoming = np.maximum(incoming, moved)
+                source = np.where(better, np.int8(p), source)
+
+            stay = self.log_stay[q]
+            if stay == -np.inf:  #state without a self-transition can only be entered from another state
+                matrix[q] = emission[q] + incoming
+                trace[q] = source
+                continue
+            possible = np.isfinite(emission[q])
+            prefix = np.cumsum(np.where(possible, emission[q], 0.0) + stay)
+            gain = incoming - stay
+            gain[1:] -= prefix[:-1]
+            values = np.concatenate(([previous[q]], gain))
+            if possible.all():
+                best = np.maximum.accumulate(values)
+            else:
+                values[1:][~possible] = -np.inf
+                best = _segmented_running_max(values, np.concatenate(([0], np.cumsum(~possible))))
+            matrix[q] = best[1:] + prefix
+            kept = np.empty(width)  #probability of remaining in q, in un-shifted space where rounding is local to each column
+            kept[0] = previous[q]
+            kept[1:] = matrix[q, :-1]
+            kept += stay
+            trace[q] = np.where(incoming > _with_tie_slack(kept), source, q)  #ties within rounding stay in q, as in step 7 of the Algorithm
+
+    def _fill_by_column(self, previous, emission, matrix, trace):
+        """Fills one block of columns given the score column that precedes it, one column at a time, for graphs with cycles.
+           Every edge is scored at once, np.maximum.reduceat picks the best edge into each state from its predecessor list, and the first
+           of edges equally probable within TIE_TOLERANCE is kept; as in _fill_by_row(), a state is only entered from elsewhere if that
+           is more probable beyond TIE_TOLERANCE.
+        """
+        edge_numbers = np.arange(len(self.edge_source))
+        states = np.arange(len(self.states), dtype=np.int8)
+        for i in range(emission.shape[1]):
+            column = previous + self.log_stay
+            source = states.copy()
+            if len(self.edge_source):
+                moved = previous[self.edge_source] + self.edge_log
+                best = np.maximum.reduceat(moved, self._group_starts)
+                winners = np.where(_with_tie_slack(moved) >= np.repeat(best, self._group_sizes), edge_numbers, len(edge_numbers))
+                better = best > _with_tie_slack(column[self._targets])
+                column[self._targets[better]] = best[better]
+                source[self._targets[better]] = self.edge_source[np.minimum.reduceat(winners, self._group_starts)[better]]
+            matrix[:, i] = column + emission[:, i]
+            trace[:, i] = source
+            previous = matrix[:, i]
+
+    def traceback(self, matrix, trace):
+        """Uses the trace matrix to find the most likely path and the log probability matrix to calculate the log probability of that path.
+           Runs of the same state are filled in one slice, so the loop only iterates once per change of state.
+        """
+        n = matrix.shape[1]
+        if n == 0:
+            return None, -np.inf
+        final = matrix[:, -1] + self.log_end  #probability of moving from each state to End
+        state = _best_state(final)
+        log_probability = float(final[state])
+        if log_probability == -np.inf:
+            return None, log_probability
+        entries = [np.flatnonzero(trace[q] != q) for q in range(len(self.states))]  #columns where the path entered each state
+        path = np.empty(n, dtype=np.int8)
+        i = n - 1
+        while state != START:
+            entered = int(entries[state][np.searchsorted(entries[state], i, side='right') - 1])
+            path[entered:i + 1] = state
+            state, i = int(trace[state, entered]), entered - 1
+        return path, log_probability
+
+    def compact_traceback(self, last_column, trace):
+        """Same as traceback() for the output of build_compact_trace(), reading the entry columns of each state from the packed trace."""
+        if trace.n == 0:
+            return None, -np.inf
+        final = last_column + self.log_end
+        state = _best_state(final)
+        log_probability = float(final[state])
+        if log_probability == -np.inf:
+            return None, log_probability
+        return self._compact_path(trace, state)[0], log_probability
+
+    def _compact_path(self, trace, state):
+        """Traces back through a CompactTrace from state at its last column. Returns the path and the state before its first column,
+           which is START unless the trace continues an earlier piece of sequence.
+        """
+        path = np.empty(trace.n, dtype=np.int8)
+        i = trace.n - 1
+        while i >= 0:
+            entered = trace.last_entry(state, i)
+            path[entered:i + 1] = state
+            state, i = trace.source(state, entered), entered - 1
+        return path, state
+
+
+class Viterbi:
+    def __init__(self, show_matrix=False):
         """ Initializes probability dictionaries with validated user input.
             Loops to call method new_sequence() until user wishes to exit to re-use the same probabilities
+            The probability matrix is only printed with each result if show_matrix is True.
         """
+        self.show_matrix = show_matrix
         self.states = ['Exon','5 Prime','Intron']
         self.state_change = {'Exon':{}, '5 Prime':{}, 'Intron':{}}  #initializes dictionary, keys = from-states, and values = {to-states: probabilities} for probabilities of switching from one state to another
         self.nucleotide_at_state={'Exon': {}, '5 Prime': {}, 'Intron': {}}  #initializes dictionary, keys = states, and values = {nucleotides: probabilities} for probabilities of nucleodies in each state
@@ -177,7 +961,7 @@ START --> Exon -->  5'  --> Intron --> End
 
     def new_sequence(self):
         """ Prompts user to enter a nucleotide sequence and validates the characters in the sequence to make sure they match nucleotides,
-            Calls methods build_matrix() and traceback() to find the most likely path of the sequence and its probability.
+            Decodes the sequence with a ViterbiModel built from the input probabilities to find the most likely path and its probability.
             """
         while True:  #breaks if characters in the sequence match capital or lowercase first letters of nucleotides (ex. A or a for Adenine)
             self.sequence = input('Enter a sequence of nucleotides (using only first letter for each nucleotide): ')
@@ -186,71 +970,30 @@ START --> Exon -->  5'  --> Intron --> End
                 break
             print('You have entered an invalid sequence. Please try again using only A, T, C, or G characters.')  #error message if sequence is not validated above
         self.n = len(self.sequence)  #after validation, sets length of sequence
-        self.build_matrix()  #using the Viterbi algorithm, buils a probability matrix
-        self.traceback()  #using the Viterbi aglorithm, traces back the most probable path using the probability and trace matrices and calculates the total probability of that path
-
-
-    def build_matrix(self):
-        """Calculates the probability and trace matrices with Viterbi algorithm to be used in tracing back the most likely path"""
-        self.matrix = [[0 for i in range(self.n)] for row_num in range(len(self.states))]  #initializes a probability matrix with rows representing states and columns representing sequence nucleotides
-        self.trace = [[0 for i in range(self.n)] for row_num in range(len(self.states))]  #initializes a trace matrix with rows representing states and columns representing traceback direction with -1 as movement diagonally down and 0 as horizontal movement
-
-        for row_num in range(len(self.states)):  #algorithm calculates one row at a time from top to bottom
-            prev_state = self.states[row_num-1]  #sets previous state based on previous row
-            state = self.states[row_num]  #sets current state based on row
-            for i in range(self.n):  #self.n indicates the number of nucleotides in the user-defined sequence
-                current_nucleotide = self.sequence[i]  #gets character of the i-th nucleotide in sequence
-                current_probability = self.nucleotide_at_state[state][current_nucleotide]  #gets the probability of current nucleotide from nucleotide_at_state dictionary
-                if row_num == 0:  #first state after start
-                    if i == 0:  #probability in first row/column of the matrix is just the probability of nucleotide
-                        self.matrix[row_num][i] = current_probability
-                    else:  #probability of first row and consecutive columns is the probability of previous cell in the same column and probability of remaining the the same state
-                        self.matrix[row_num][i] = current_probability * self.matrix[row_num][i-1] * self.state_change[state][state]
-                        self.trace[0][i] = 0  #horizontal direction
-                else:  #consecutive states
-                    if (self.matrix[row_num-1][i-1] * self.state_change[prev_state][state]) > (self.matrix[row_num][i-1] * self.state_change[state][state]): #if diagonal move into this cell is greater than the horizonal move into this cell
-                        max_incoming_probability = self.matrix[row_num-1][i-1] * self.state_change[prev_state][state]  #set the maximum as the probability of the diagonal move
-                        direction = -1  #diagonal direction
-                    else: #if probability of moving into this cell horizonally is greater than diagonally
-                        max_incoming_probability = self.matrix[row_num][i-1] * self.state_change[state][state]  #set the maximum as the probability of the horizontal move
-                        direction = 0  #horizontal direction
-
-                    if (state == '5 Prime' and i == 0) or (state == 'Intron' and (i == 0 or i == 1)):
-                        self.matrix[row_num][i] = 0  #fill first column of 5' and first two columns of Intron as 0s due to no vertical movement allowed
-                    else:
-                        self.matrix[row_num][i] = current_probability * max_incoming_probability  #for all other cells, cell value is probability of current cell times probability of either horizontal or vertical movement in
-                    self.trace[row_num][i] = direction  #set corresponding cell in trace matrix to the movement direction
-
-
-    def traceback(self):
-        """Uses the trace matrix to find the most likely path and probability matrix to calculate the probability of that path."""
-        path = [0 for i in range(self.n)]  #initializes path as a list
-        row = len(self.trace) - 1  #initializes row as the last row in trace matrix
-        for i in range(self.n-1, -1, -1):  #iterates backwards, from the last state to the first state
-            path[i] = self.states[row]  #sets i-th item of path list as the state that represents the row of the current cell
-            if row != 0:  #evaluates whether algorithm reached the first row
-                row += self.trace[row][i]  #if algorithm has not reached first row, then add the direction (-1 for diagonal, 0 for horizontal) to the current row (ex: if row = 2 and direction into it was diagonal then new row = 2 + (-1) = 1, traceback moves up)
-
-        path_prob = self.matrix[2][self.n-1] * self.prob_end  #calculates the path probability by taking the last row/column of probability matrix and multiplying by start and end contant probabilities
-
-        self.output_result(path,path_prob)  #calls method to print the output
-
-    def output_result(self,path,path_prob):
-        """Generates on-screen print of the program output: path, probability of the path, and the probability matrix created by build_matrix method."""
-        if path_prob == 0:  #if path_prob returned 0 as the probability, notifies user that sequence is improbable
+        model = ViterbiModel.from_e5i(self.state_change['Exon']['5 Prime'], self.state_change['5 Prime']['Intron'], self.prob_end,
+                                      self.nucleotide_at_state)  #log-space model, so that long sequences do not underflow to probability 0
+        result = model.decode(self.sequence)  #using the Viterbi algorithm, fills the matrices and traces back the most probable path
+        self.matrix = result.matrix
+        path = [[model.states[state], start + 1, end] for state, start, end in result.segments]  #runs of [state, first position, last position]
+        self.output_result(path, result.log_probability)  #calls method to print the output
+
+    def output_result(self,path,log_probability):
+        """Generates on-screen print of the program output: path, probability of the path, and, if show_matrix is on, the probability matrix
+           calculated by ViterbiModel. Probabilities too small to print as numbers are given as natural logarithms instead.
+        """
+        if not path:  #if no path was found, notifies user that sequence is improbable
             print('\n--> Using the Viterbi algorithm, no probable path exists for {}'.format(self.sequence))
-        else:  #if path_prob is greater than 0, notifies user of the original sequence, path, and its probability, and outputs the probability matrix
-            print('\nUsing Viterbi algorithm, the most probable state of {} is \n{} \nwith overall probability of {}'.format(self.sequence, path, path_prob))
-            print('-'*50)
-            header = ''
-            for j in range(self.n):
-                header += ('\t' + self.sequence[j])  #header displays sequence nucleotides input by the user
-            print(header.expandtabs(24))
-            for i in range(len(self.states)):
-                row = self.states[i]  #each row is associated with each state
-                for j in range(self.n):
-                    row += ('\t' + str(self.matrix[i][j]))  #each row's cells are corresponding values from the probability matrix
-                print(row.expandtabs(24))
-            print('-'*50)
-
-Viterbi()
+        else:  #otherwise notifies user of the original sequence, path, and its probability, and outputs the probability matrix
+            runs = ', '.join('{} {}-{}'.format(state, first, last) for state, first, last in path)  #each run of a state with its first and last position
+            path_prob = np.exp(log_probability)
+            probability = 'probability of {}'.format(path_prob) if path_prob > 0 else 'log probability of {}'.format(log_probability)
+            print('\nUsing Viterbi algorithm, the most probable state of {} is \n{} \nwith overall {}'.format(self.sequence, runs, probability))
+            if self.show_matrix:
+                print('-'*50)
+                print(''.join('\t' + nucleotide for nucleotide in self.sequence).expandtabs(24))  #header displays sequence nucleotides input by the user
+                for i in range(len(self.states)):  #each row is associated with each state, its cells are corresponding values from the probability matrix
+                    print((self.states[i] + ''.join('\t' + str(probability) for probability in np.exp(self.matrix[i]))).expandtabs(24))
+                print('-'*50)
+
+if __name__ == '__main__':
+    Viterbi(show_matrix='--matrix' in sys.argv[1:])
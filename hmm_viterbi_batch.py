@@ -0,0 +1,210 @@
+'''Hidden Markov Model Viterbi Algorithm - batch decoding
+Purpose:        To decode every record of a multi-record FASTA file with the same Exon, 5', Intron parameters, spreading the records
+                over a pool of worker processes and writing each result as soon as it is available.
+
+Description:    The parameters are read once from a JSON file of the form
+                    {"exon_to_5prime": 0.1, "five_prime_to_intron": 0.5, "intron_to_end": 0.1,
+                     "nucleotide_at_state": {"Exon": {"A": 0.25, "T": 0.25, "C": 0.25, "G": 0.25}, "5 Prime": {...}, "Intron": {...}},
+                     "ambiguous": {"N": "ACGT"}}
+                and turned into a ViterbiModel; "ambiguous" is optional and lists symbols standing for several nucleotides, so that runs of
+                N in assemblies and .2bit files can be decoded. A general state graph may be given instead, see load_parameters().
+                The model is handed to each worker process once, when the worker starts, so only the records themselves travel to the
+                workers. Each worker formats its own output line, so the per-base path never travels back.
+                Output is tab separated: record name, sequence length, natural log probability of the path, and the path written as
+                runs of states (ex. Exon:1-40,5 Prime:41-42,Intron:43-100, positions counted from 1).
+                With --format tsv, bed or gff3 every run of states is written on a line of its own instead (see hmm_viterbi_output).
+                Records are written in input order by default; with --unordered they are written as soon as each one is decoded.
+                With --timings (summary format only) three more columns give the seconds spent encoding, filling the matrix and tracing
+                back each record; for FASTA and .2bit files the first one is the time this process took to read and encode the record
+                from the mapped file.
+
+                FASTA and .2bit files are memory-mapped and each record is encoded into symbol codes in this process (see hmm_viterbi_ingest),
+                so workers receive compact uint8 arrays; FASTA from standard input is read as text.
+
+Instructions:   python hmm_viterbi_batch.py parameters.json sequences.fasta -o results.tsv --processes 8
+                use "-" (or leave out the file name) to read FASTA from standard input.
+'''
+import argparse
+import json
+import os
+import sys
+from collections import deque
+from contextlib import nullcontext
+from multiprocessing import Pool
+from queue import Queue
+
+from hidden_markov_model_viterbi_E5I import ViterbiModel, path_segments
+from hmm_viterbi_ingest import open_sequences
+from hmm_viterbi_output import WRITERS, writer_for
+
+_worker_model = None  #model held by each worker process, set once by _init_worker()
+_worker_format = 'summary'  #output format of each worker process, set once by _init_worker()
+
+
+def load_parameters(path):
+    """Reads model parameters from a JSON file and returns the corresponding ViterbiModel.
+       The file holds either the E5I parameters, optionally with "ambiguous", or a general state graph with the arguments of ViterbiModel
+       ("states", "transitions" as [from, to, probability] lists, "emissions", "start", "end" and optionally "alphabet" and "ambiguous").
+    """
+    with open(path) as handle:
+        parameters = json.load(handle)
+    if 'states' in parameters:
+        return ViterbiModel(**parameters)
+    return ViterbiModel.from_e5i(parameters['exon_to_5prime'], parameters['five_prime_to_intron'],
+                                 parameters['intron_to_end'], parameters['nucleotide_at_state'], parameters.get('ambiguous'))
+
+
+def read_fasta(handle):
+    """Yields (name, sequence) for each record of a FASTA file object, joining the sequence lines of a record."""
+    name, lines = None, []
+    for line in handle:
+        line = line.strip()
+        if line.startswith('>'):
+            if name is not None:
+                yield name, ''.join(lines)
+            header = line[1:].split()
+            name, lines = (header[0] if header else ''), []  #record name is the first word of the header line
+        elif line and name is not None:
+            lines.append(line)
+    if name is not None:
+        yield name, ''.join(lines)
+
+
+def read_sequence_file(path, table, failures, stats=None):
+    """Yields (name, codes) for each record of a FASTA or .2bit file, encoded with the translation table of the model.
+       Records with characters outside the alphabet are reported on standard error, counted in failures[0] and skipped.
+       With a DecoderStats, reading each record is timed as its ingest phase and the seconds are added to the record as a third item.
+    """
+    with open_sequences(path, table) as sequences:
+        for position, name in enumerate(sequences.names):  #by position, so that records with the same name are all read
+            try:
+                with stats.phase('ingest') if stats is not None else nullcontext():
+                    codes = sequences.sequence(position)
+            except ValueError as error:
+                failures[0] += 1
+                print('{}: {}'.format(name, error), file=sys.stderr)
+                continue
+            yield (name, codes) if stats is None else (name, codes, stats.last['ingest'])
+
+
+def format_path(states, path):
+    """Writes a path of state indices as comma separated runs of states with 1-based inclusive positions."""
+    return ','.join('{}:{}-{}'.format(states[state], start + 1, end) for state, start, end in path_segments(path))
+
+
+def decode_record(model, record, output_format='summary'):
+    """Decodes one (name, sequence) record and returns (name, output lines, error message); one of the last two is None.
+       A third item of the record is the time already spent reading and encoding it (see read_sequence_file()).
+       output_format is 'summary' for one line per record, or one of the formats of hmm_viterbi_output for one line per run of states.
+    """
+    name, sequence = record[:2]
+    try:
+        result = model.decode(sequence)
+    except ValueError as error:
+        return name, None, str(error)
+    if result.path is None:
+        return name, None, 'no probable path exists'
+    if output_format != 'summary':
+        return name, writer_for(output_format, None, model.states).format_record(name, result.segments, result.log_probability), None
+    line = '{}\t{}\t{!r}\t{}'.format(name, len(sequence), result.log_probability, format_path(model.states, result.path))
+    if model.stats is not None:  #instrumentation is on: adds the seconds spent in each phase of this record
+        seconds = dict(model.stats.last)
+        if len(record) > 2:
+            seconds['encode'] = record[2]  #encoded while reading the file; decode() only received the codes
+        line += ''.join('\t{:.6f}'.format(seconds[phase]) for phase in ('encode', 'fill', 'traceback'))
+    return name, line + '\n', None
+
+
+def _init_worker(model, output_format='summary'):
+    """Stores the model and output format in the worker process so that they are not sent again with every record."""
+    global _worker_model, _worker_format
+    _worker_model, _worker_format = model, output_format
+
+
+def _decode_in_worker(record):
+    """Decodes one record with the model given to this worker by _init_worker()."""
+    return decode_record(_worker_model, record, _worker_format)
+
+
+def decode_records(model, records, processes=None, ordered=True, max_pending=None, output_format='summary'):
+    """Yields decode_record() results for an iterable of (name, sequence) records as they finish.
+       processes is the size of the worker pool (default: number of CPUs); with processes=1 records are decoded in this process.
+       ordered=False yields results as soon as they are ready instead of in input order.
+       At most max_pending records (default: 4 per worker) are read ahead of the output, so memory does not grow with the input.
+    """
+    if processes == 1:
+        for record in records:
+            yield decode_record(model, record, output_format)
+        return
+    processes = processes or os.cpu_count()
+    max_pending = max_pending or 4 * processes
+    with Pool(processes, initializer=_init_worker, initargs=(model, output_format)) as pool:
+        if ordered:
+            pending = deque()  #results in input order, oldest first
+            for record in records:
+                pending.append(pool.apply_async(_decode_in_worker, (record,)))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        else:
+            finished = Queue()  #results in the order the workers finish them
+            in_flight = 0
+            for record in records:
+                pool.apply_async(_decode_in_worker, (record,), callback=finished.put, error_callback=finished.put)
+                in_flight += 1
+                if in_flight >= max_pending:
+                    yield _finished_result(finished)
+                    in_flight -= 1
+            for _ in range(in_flight):
+                yield _finished_result(finished)
+
+
+def _finished_result(finished):
+    """Takes the next result from the queue filled by the pool callbacks, re-raising an exception from a worker."""
+    result = finished.get()
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+def main(argv=None):
+    """Command line entry point: decodes a FASTA file and streams one result line per record to the output."""
+    parser = argparse.ArgumentParser(description='Decode every record of a FASTA file through Exon, 5\' and Intron states.')
+    parser.add_argument('parameters', help='JSON file with the E5I model parameters')
+    parser.add_argument('fasta', nargs='?', default='-', help='FASTA or .2bit file to decode (default: FASTA from standard input)')
+    parser.add_argument('-o', '--output', default='-', help='output file (default: standard output)')
+    parser.add_argument('-p', '--processes', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--max-pending', type=int, help='records read ahead of the output (default: 4 per process)')
+    parser.add_argument('--unordered', action='store_true', help='write records as soon as they finish instead of in input order')
+    parser.add_argument('--format', default='summary', choices=['summary'] + list(WRITERS),
+                        help='one summary line per record (default), or one line per run of states as tsv, bed or gff3')
+    parser.add_argument('--timings', action='store_true',
+                        help='add the seconds spent encoding, filling and tracing back each record (summary format only)')
+    args = parser.parse_args(argv)
+    if args.timings and args.format != 'summary':
+        parser.error('--timings adds columns to the summary lines and cannot be used with --format {}'.format(args.format))
+
+    model = load_parameters(args.parameters)
+    if args.timings:
+        model.instrument()
+    failures = [0]  #number of records that could not be decoded
+    records = read_fasta(sys.stdin) if args.fasta == '-' else read_sequence_file(args.fasta, model.symbol_codes, failures, model.stats)
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        if args.format != 'summary':
+            output.write(WRITERS[args.format].header)
+        for name, line, error in decode_records(model, records, args.processes, not args.unordered, args.max_pending, args.format):
+            if error is None:
+                output.write(line)
+            else:
+                failures[0] += 1
+                print('{}: {}'.format(name, error), file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 1 if failures[0] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
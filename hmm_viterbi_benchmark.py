@@ -0,0 +1,171 @@
+'''Hidden Markov Model Viterbi Algorithm - benchmark
+Purpose:        To measure the speed and memory of the Viterbi decoder on synthetic sequences of growing length, and to keep the results
+                as JSON so that different versions of the decoder can be compared.
+
+Description:    Sequences are generated from the model itself: the path starts in a state drawn from the start probabilities, stays
+                in each state for a geometrically distributed number of nucleotides and moves on along the outgoing transitions, and
+                every nucleotide is drawn from the emission probabilities of its state. By default the model is the Exon, 5', Intron
+                example of the interactive program; a JSON parameter file as used by hmm_viterbi_batch.py may be given instead.
+                For every size the decode is split into phases, each timed separately (best of --repeat runs):
+                    ingest      encoding the nucleotide text into symbol codes
+                    fill        build_matrix(), or build_compact_trace() with --low-memory
+                    traceback   traceback(), or compact_traceback() with --low-memory
+                    output      writing the path as runs of states, as hmm_viterbi_batch.py does
+                Cells per second is states x nucleotides divided by the fill time. Peak memory is measured with tracemalloc in one extra
+                run, so that tracing does not slow the timed runs.
+
+Instructions:   python hmm_viterbi_benchmark.py --max-exponent 8 --low-memory -o results.json
+                python hmm_viterbi_benchmark.py --baseline results.json      # prints the speed of this version relative to a saved run
+'''
+import argparse
+import json
+import platform
+import sys
+import tracemalloc
+from datetime import datetime, timezone
+from time import perf_counter
+
+import numpy as np
+
+from hidden_markov_model_viterbi_E5I import ViterbiModel
+from hmm_viterbi_batch import format_path, load_parameters
+
+EXAMPLE_PARAMETERS = (0.1, 0.5, 0.1, {'Exon': {'A': 0.25, 'T': 0.25, 'C': 0.25, 'G': 0.25},
+                                      '5 Prime': {'A': 0.8, 'T': 0.15, 'C': 0.05, 'G': 0},
+                                      'Intron': {'A': 0.4, 'T': 0.4, 'C': 0.1, 'G': 0.1}})  #example of the interactive program
+
+
+def synthetic_path(model, n, rng):
+    """Draws a path of n states from the model, one run of a state at a time; End is ignored until n states are drawn."""
+    path = np.empty(n, dtype=np.int8)
+    stay = np.exp(model.log_stay)
+    start = np.exp(model.log_start)
+    state = rng.choice(len(start), p=start / start.sum())
+    i = 0
+    while i < n:
+        leaving = np.flatnonzero(model.edge_source == state)  #edges out of the state, found in the predecessor lists
+        if len(leaving) == 0 or stay[state] >= 1:
+            path[i:] = state
+            break
+        run = rng.geometric(1 - stay[state])
+        path[i:i + run] = state
+        i += run
+        targets = np.searchsorted(model.edge_start, leaving, side='right') - 1  #the state each of those edges leads into
+        weights = np.exp(model.edge_log[leaving])
+        state = targets[rng.choice(len(targets), p=weights / weights.sum())]
+    return path
+
+
+def synthetic_sequence(model, n, rng):
+    """Draws a path of n states and a nucleotide for each of them; returns the nucleotides as ASCII bytes and the path."""
+    path = synthetic_path(model, n, rng)
+    emissions = np.exp(model.log_emissions[:, :len(model.alphabet)])
+    codes = np.empty(n, dtype=np.uint8)
+    for state in range(len(model.states)):
+        positions = np.flatnonzero(path == state)
+        codes[positions] = rng.choice(len(model.alphabet), size=len(positions), p=emissions[state] / emissions[state].sum())
+    return np.frombuffer(model.alphabet.encode('ascii'), dtype=np.uint8)[codes].tobytes(), path
+
+
+def run_phases(model, text, low_memory):
+    """Decodes the text once and returns the seconds spent in each phase."""
+    seconds = {}
+    began = perf_counter()
+    codes = model.encode(text)
+    seconds['ingest'] = perf_counter() - began
+    began = perf_counter()
+    if low_memory:
+        last_column, trace, _ = model.build_compact_trace(codes)
+    else:
+        matrix, trace = model.build_matrix(codes)
+    seconds['fill'] = perf_counter() - began
+    began = perf_counter()
+    if low_memory:
+        path, _ = model.compact_traceback(last_column, trace)
+    else:
+        path, _ = model.traceback(matrix, trace)
+    seconds['traceback'] = perf_counter() - began
+    began = perf_counter()
+    if path is not None:
+        format_path(model.states, path)
+    seconds['output'] = perf_counter() - began
+    return seconds
+
+
+def peak_memory(model, text, low_memory):
+    """Returns the peak memory allocated while decoding the text once, in bytes."""
+    tracemalloc.start()
+    try:
+        run_phases(model, text, low_memory)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(model, sizes, low_memory=False, repeat=3, seed=0, report=None):
+    """Returns one result dictionary per sequence length in sizes; report, if given, is called with each result as it is ready."""
+    rng = np.random.default_rng(seed)
+    results = []
+    for n in sizes:
+        text, _ = synthetic_sequence(model, n, rng)
+        runs = [run_phases(model, text, low_memory) for _ in range(repeat)]
+        seconds = {phase: min(run[phase] for run in runs) for phase in runs[0]}
+        result = {'bases': n, 'states': len(model.states), 'cells': n * len(model.states), 'seconds': seconds,
+                  'total_seconds': sum(seconds.values()), 'cells_per_second': n * len(model.states) / max(seconds['fill'], 1e-12),
+                  'peak_memory': peak_memory(model, text, low_memory)}
+        results.append(result)
+        if report is not None:
+            report(result)
+    return results
+
+
+def compare(results, baseline):
+    """Returns (bases, fill speed-up, total speed-up) for every size present in both result lists; above 1 means faster than baseline."""
+    previous = {result['bases']: result for result in baseline}
+    return [(result['bases'], previous[result['bases']]['seconds']['fill'] / result['seconds']['fill'],
+             previous[result['bases']]['total_seconds'] / result['total_seconds'])
+            for result in results if result['bases'] in previous]
+
+
+def main(argv=None):
+    """Command line entry point: runs the benchmark, prints a table and optionally saves the results as JSON."""
+    parser = argparse.ArgumentParser(description='Benchmark the Viterbi decoder on synthetic sequences.')
+    parser.add_argument('--parameters', help='JSON parameter file (default: the example of the interactive program)')
+    parser.add_argument('--min-exponent', type=int, default=2, help='shortest sequence is 10 to this power (default: 2)')
+    parser.add_argument('--max-exponent', type=int, default=6, help='longest sequence is 10 to this power (default: 6)')
+    parser.add_argument('--low-memory', action='store_true', help='benchmark the low-memory mode')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per size, the fastest is kept (default: 3)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic sequences')
+    parser.add_argument('--label', default='', help='free text saved with the results, e.g. the version being measured')
+    parser.add_argument('-o', '--output', help='JSON file to save the results to')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    model = load_parameters(args.parameters) if args.parameters else ViterbiModel.from_e5i(*EXAMPLE_PARAMETERS)
+    sizes = [10 ** exponent for exponent in range(args.min_exponent, args.max_exponent + 1)]
+    print('{:>12} {:>10} {:>10} {:>10} {:>10} {:>14} {:>12}'.format(
+        'bases', 'ingest s', 'fill s', 'trace s', 'output s', 'cells/s', 'peak MB'))
+
+    def report(result):
+        seconds = result['seconds']
+        print('{:>12} {:>10.4f} {:>10.4f} {:>10.4f} {:>10.4f} {:>14.4g} {:>12.1f}'.format(
+            result['bases'], seconds['ingest'], seconds['fill'], seconds['traceback'], seconds['output'],
+            result['cells_per_second'], result['peak_memory'] / 1e6))
+        sys.stdout.flush()
+
+    results = benchmark(model, sizes, args.low_memory, args.repeat, args.seed, report)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump({'label': args.label, 'created': datetime.now(timezone.utc).isoformat(), 'python': platform.python_version(),
+                       'numpy': np.__version__, 'platform': platform.platform(), 'parameters': args.parameters or 'example',
+                       'low_memory': args.low_memory, 'repeat': args.repeat, 'seed': args.seed, 'results': results}, handle, indent=2)
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        print('\nspeed relative to {} ({})'.format(args.baseline, baseline.get('label') or baseline.get('created')))
+        for bases, fill, total in compare(results, baseline['results']):
+            print('{:>12} fill x{:.2f} total x{:.2f}'.format(bases, fill, total))
+
+
+if __name__ == '__main__':
+    main()
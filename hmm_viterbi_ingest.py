@@ -0,0 +1,166 @@
+'''Hidden Markov Model Viterbi Algorithm - sequence file ingestion
+Purpose:        To read multi-GB FASTA and UCSC .2bit genome files straight into arrays of symbol codes for ViterbiModel, without building
+                Python strings or a second copy of the file.
+
+Description:    Files are memory-mapped, so the operating system pages them in as records are read and the file itself is never copied.
+                Opening a file only finds where each record starts; a record is encoded when it is requested.
+                Records are kept in file order, so iterating yields every record even when names repeat or are empty; looking a record
+                up by name with file[name] gives the first record of that name.
+                FASTA records are turned into codes with a single translation-table pass over the mapped bytes. When all lines of a record
+                have the same length, as FASTA writers produce, the mapped bytes are viewed as a table of lines and the line breaks are
+                skipped by slicing that view, so the codes are written straight into the output array.
+                .2bit records hold four nucleotides per byte; a 256-entry table turns every byte into its four codes at once, and the
+                blocks of N listed in the record are filled in afterwards.
+                Codes are validated with one vectorized comparison; any character outside the model alphabet raises ValueError.
+
+Instructions:   with open_sequences('genome.fa', model.symbol_codes) as sequences:
+                    for name, codes in sequences:
+                        result = model.decode(codes)
+'''
+import mmap
+import struct
+
+import numpy as np
+
+from hidden_markov_model_viterbi_E5I import BASE_CODES, validate_codes
+
+NEWLINE = ord('\n')
+CARRIAGE_RETURN = ord('\r')
+TWO_BIT_SIGNATURE = 0x1A412743
+TWO_BIT_BASES = b'TCAG'  #nucleotide stored as 0, 1, 2, 3 in a .2bit file
+
+
+def open_sequences(path, table=BASE_CODES):
+    """Opens a FASTA or .2bit file, recognised by the .2bit signature, encoding records with the given translation table."""
+    with open(path, 'rb') as handle:
+        signature = handle.read(4)
+    if len(signature) == 4 and TWO_BIT_SIGNATURE in struct.unpack('<I', signature) + struct.unpack('>I', signature):
+        return TwoBitFile(path, table)
+    return FastaFile(path, table)
+
+
+class _MappedFile:
+    """Common part of FastaFile and TwoBitFile: the memory map, the record index and iteration over encoded records."""
+    def __init__(self, path, table):
+        self.table = table
+        with open(path, 'rb') as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) if handle.seek(0, 2) else b''
+        self._data = np.frombuffer(self._map, dtype=np.uint8)  #zero-copy view of the whole file
+        self.records = self._read_index()  #[(name, location of the record in the file)] in file order
+        self.index = {}  #{name: position in records} of the first record of each name
+        for position, (name, _) in enumerate(self.records):
+            self.index.setdefault(name, position)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Releases the memory map; arrays returned earlier stay valid since they are copies made by encoding."""
+        self._data = None
+        if isinstance(self._map, mmap.mmap):
+            try:
+                self._map.close()
+            except BufferError:  #a view of the map is still referenced, e.g. by a traceback; the map closes when it is released
+                pass
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        """Yields (name, codes) for every record in file order, encoding one record at a time."""
+        for position, (name, _) in enumerate(self.records):
+            yield name, self.sequence(position)
+
+    def __getitem__(self, name):
+        """Returns the codes of the first record with this name."""
+        return self.sequence(self.index[name])
+
+    def sequence(self, position):
+        """Returns the codes of the record at this position in file order."""
+        return self._encode(self.records[position][1])
+
+    @property
+    def names(self):
+        """Names of the records in file order, repeated names included."""
+        return [name for name, _ in self.records]
+
+
+class FastaFile(_MappedFile):
+    """Memory-mapped FASTA file; iterating yields (name, codes) pairs and file[name] returns the codes of a record."""
+    def _read_index(self):
+        """Finds the header of every record with mmap.find and keeps the byte range of its sequence lines."""
+        breaks = [-1] if self._map[:1] == b'>' else []  #position of the line break in front of each header
+        position = self._map.find(b'\n>')
+        while position != -1:
+            breaks.append(position)
+            position = self._map.find(b'\n>', position + 1)
+        records = []
+        for before, end in zip(breaks, breaks[1:] + [len(self._map)]):
+            line_end = self._map.find(b'\n', before + 1, end)
+            line_end = end if line_end == -1 else line_end
+            words = bytes(self._map[before + 2:line_end]).split()  #header line without the '>'
+            records.append((words[0].decode() if words else '', (min(line_end + 1, end), end)))
+        return records
+
+    def _encode(self, location):
+        first, last = location
+        raw = self._data[first:last]  #view of the mapped sequence lines
+        breaks = np.flatnonzero(raw == NEWLINE)
+        width = int(breaks[0]) + 1 if len(breaks) else 0  #bytes per line including the line break
+        expected = np.arange(width - 1, width * len(breaks), max(width, 1))  #where the line breaks are if every line has the same length
+        regular = width > 1 and np.array_equal(breaks[:-1], expected[:-1]) and breaks[-1] in (expected[-1], len(raw) - 1)
+        if regular:  #all lines have the same length, apart from a shorter last line
+            full = len(breaks) - (breaks[-1] != expected[-1])  #lines of full length
+            length = width - 1 - (raw[width - 2] == CARRIAGE_RETURN)  #bases per line
+            lines = raw[:width * full].reshape(-1, width)[:, :length]  #strided view skipping the line breaks
+            tail = raw[width * full:]  #shorter last line
+            while len(tail) and tail[-1] in (NEWLINE, CARRIAGE_RETURN):
+                tail = tail[:-1]
+            codes = np.empty(lines.size + len(tail), dtype=np.uint8)
+            np.take(self.table, lines, out=codes[:lines.size].reshape(lines.shape))
+            np.take(self.table, tail, out=codes[lines.size:])
+        else:  #irregular line lengths: drop line breaks with a mask, at the cost of one copy of the record
+            codes = self.table[raw[(raw != NEWLINE) & (raw != CARRIAGE_RETURN)]]
+        return validate_codes(codes, self.table)
+
+
+class TwoBitFile(_MappedFile):
+    """Memory-mapped UCSC .2bit file; iterating yields (name, codes) pairs and file[name] returns the codes of a record."""
+    def __init__(self, path, table):
+        super().__init__(path, table)
+        bases = table[np.frombuffer(TWO_BIT_BASES, dtype=np.uint8)]
+        self._unpack = bases[(np.arange(256)[:, None] >> np.array([6, 4, 2, 0])) & 3]  #codes of the four nucleotides packed in every byte value
+
+    def _read_index(self):
+        """Reads the file header and the table of record names and offsets, in the byte order given by the signature."""
+        self._order = '<' if struct.unpack_from('<I', self._map, 0)[0] == TWO_BIT_SIGNATURE else '>'
+        version, count, _ = struct.unpack_from(self._order + 'III', self._map, 4)
+        if version != 0:
+            raise ValueError('Unsupported .2bit version {}.'.format(version))
+        records, position = [], 16
+        for _ in range(count):
+            length = self._map[position]
+            name = bytes(self._map[position + 1:position + 1 + length]).decode()
+            records.append((name, struct.unpack_from(self._order + 'I', self._map, position + 1 + length)[0]))
+            position += length + 5
+        return records
+
+    def _blocks(self, position):
+        """Reads a block list (count, starts, sizes) at position and returns starts, sizes and the position after it."""
+        count = struct.unpack_from(self._order + 'I', self._map, position)[0]
+        blocks = np.frombuffer(self._map, dtype=self._order + 'u4', count=2 * count, offset=position + 4).reshape(2, count)
+        return blocks[0], blocks[1], position + 4 + 8 * count
+
+    def _encode(self, position):
+        length = struct.unpack_from(self._order + 'I', self._map, position)[0]
+        n_starts, n_sizes, position = self._blocks(position + 4)
+        _, _, position = self._blocks(position)  #lower case blocks do not matter for decoding
+        packed = self._data[position + 4:position + 4 + (length + 3) // 4]  #skips the reserved word
+        codes = self._unpack[packed].reshape(-1)[:length]  #one table lookup gives four codes per byte
+        unknown = self.table[ord('N')]
+        for start, size in zip(n_starts, n_sizes):
+            codes[start:start + size] = unknown
+        return validate_codes(codes, self.table)
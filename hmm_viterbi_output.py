@@ -0,0 +1,113 @@
+'''Hidden Markov Model Viterbi Algorithm - output writers
+Purpose:        To write decoded paths as runs of states (segments) in BED, GFF3 or TSV format, and to save the probability matrix as a
+                binary NumPy file when it is wanted.
+
+Description:    Writers take the (state index, start, end) segments given by ViterbiResult.segments or ViterbiModel.decode_stream(),
+                0-based with end excluded, and write one line per segment, so the path is never turned into one string per nucleotide.
+                Segments may come from a generator; each line is written as soon as its segment arrives.
+                    BED     record, start, end (0-based, end excluded) and state name, with whitespace replaced by _ (5_Prime)
+                    GFF3    record, source, state name as the type, start and end (1-based, end included), and a Name attribute;
+                            the log probability of the path is written as a comment line before the segments of each record
+                    TSV     record, state name, start and end (1-based, end included), with a header line
+                The probability matrix is only written by save_matrix(), as a .npy file that numpy.load() reads back.
+
+Instructions:   with open('genes.gff3', 'w') as handle:
+                    writer = writer_for('gff3', handle, model.states)
+                    writer.write('chr1', result.segments, result.log_probability)
+'''
+from urllib.parse import quote
+
+import numpy as np
+
+
+class SegmentWriter:
+    """Writes the segments of decoded records to a text file object, one line per segment; subclasses define the line format."""
+    header = ''  #written once, before the first record
+
+    def __init__(self, handle, states):
+        self.handle = handle
+        self.states = states
+        self._started = False
+
+    def write(self, name, segments, log_probability=None):
+        """Writes the segments of one record as they are produced by the segments iterable."""
+        if not self._started:
+            self.handle.write(self.header)
+            self._started = True
+        self.handle.write(self.record_header(name, log_probability))
+        for segment in segments:
+            self.handle.write(self.format_segment(name, segment))
+
+    def format_record(self, name, segments, log_probability=None):
+        """Returns the lines of one record as a single string, e.g. to be formatted by a worker process and written later."""
+        return self.record_header(name, log_probability) + ''.join(self.format_segment(name, segment) for segment in segments)
+
+    def record_header(self, name, log_probability):
+        """Returns the lines written in front of the segments of a record; nothing by default."""
+        return ''
+
+    def format_segment(self, name, segment):
+        raise NotImplementedError
+
+
+class BedWriter(SegmentWriter):
+    """BED lines: record, start and end (0-based, end excluded), state name with whitespace replaced by _ (ex. 5_Prime)."""
+    def __init__(self, handle, states):
+        super().__init__(handle, states)
+        self._names = ['_'.join(state.split()) for state in states]  #whitespace would split the name column for many BED readers
+
+    def format_segment(self, name, segment):
+        state, start, end = segment
+        return '{}\t{}\t{}\t{}\n'.format(name, start, end, self._names[state])
+
+
+class Gff3Writer(SegmentWriter):
+    """GFF3 lines: state name as the feature type, 1-based positions with end included, no score, strand or phase."""
+    header = '##gff-version 3\n'
+
+    def __init__(self, handle, states, source='hmm_viterbi'):
+        super().__init__(handle, states)
+        self.source = _gff_escape(source)
+        self._types = [_gff_escape(state) for state in states]  #escaped once, not for every line
+
+    def record_header(self, name, log_probability):
+        return '' if log_probability is None else '# {} log_probability={!r}\n'.format(name, log_probability)
+
+    def format_segment(self, name, segment):
+        state, start, end = segment
+        return '{}\t{}\t{}\t{}\t{}\t.\t.\t.\tName={}\n'.format(
+            _gff_escape(name), self.source, self._types[state], start + 1, end, self._types[state])
+
+
+class TsvWriter(SegmentWriter):
+    """Tab separated lines: record, state name, start and end (1-based, end included)."""
+    header = 'record\tstate\tstart\tend\n'
+
+    def format_segment(self, name, segment):
+        state, start, end = segment
+        return '{}\t{}\t{}\t{}\n'.format(name, self.states[state], start + 1, end)
+
+
+WRITERS = {'bed': BedWriter, 'gff3': Gff3Writer, 'tsv': TsvWriter}
+
+
+def writer_for(output_format, handle, states):
+    """Returns the writer of an output format named in WRITERS."""
+    try:
+        return WRITERS[output_format](handle, states)
+    except KeyError:
+        raise ValueError('Unknown output format {!r}; expected one of {}.'.format(output_format, ', '.join(WRITERS))) from None
+
+
+def save_matrix(path, result):
+    """Saves the log probability matrix of a ViterbiResult as a binary .npy file (states x nucleotides).
+       Raises ValueError if the matrix was not kept, as after decode(low_memory=True) without keep_matrix.
+    """
+    if result.matrix is None:
+        raise ValueError('The matrix was not kept; decode with keep_matrix=True to save it.')
+    np.save(path, result.matrix)
+
+
+def _gff_escape(text):
+    """Percent-encodes the characters GFF3 reserves (tab, newline, carriage return, %, ;, =, &, and ,)."""
+    return quote(text, safe=' !"#$\'()*+-./:<>?@[\\]^_`{|}~')
@@ -0,0 +1,244 @@
+'''Sky Map - batch renderer
+Purpose:        To draw the sky above a place at a given time, as in Sky Map Demo.ipynb, for many (location, time) frames at once, e.g. the
+                thousands of charts of a time-lapse, writing each chart to an image file.
+
+Description:    Everything that does not change from one frame to the next is prepared once and kept in a cache directory, so that after
+                the first run no download or online lookup is needed:
+                    de421.bsp           the ephemeris giving the position of the earth, downloaded once by the skyfield Loader
+                    hip_main.dat        the Hipparcos catalog, downloaded once
+                    hipparcos_mag<m>/   the stars of the catalog no fainter than the limiting magnitude m, one .npy file per column,
+                                        memory-mapped when read so the catalog text is parsed only once per magnitude limit
+                    locations.json      latitude, longitude and timezone of every place name looked up so far
+                Place names are geocoded with Nominatim and their timezone found with tzwhere only when they are not in locations.json;
+                tzwhere is slow to build, so it is built at most once per run and only when needed.
+                The magnitude cut and the marker sizes S_i = S_0 * 10 ^ (m_i / -2.5) are computed once when the catalog is loaded, so each
+                frame only projects the stars that are drawn. Each worker process loads the ephemeris and catalog once and reuses one
+                matplotlib figure (Agg backend, no window), moving the star markers and saving the figure for every frame.
+                Frames are given in UTC, so that a time-lapse steps evenly through daylight saving changes.
+
+Instructions:   python sky_map.py "Times Square, New York, NY" "2023-01-01 00:00" --end "2023-01-02 00:00" --step 10 -o frames -p 8
+                writes frames/frame_00000.png, frames/frame_00001.png, ... one chart every 10 minutes of local time from the start.
+                In Python:
+                    location = resolve_location('Times Square, New York, NY')
+                    start = to_utc(location, '2023-01-01 00:00')
+                    frames = time_lapse(location, start, start + timedelta(days=1), timedelta(minutes=10), 'frames')
+                    for path in render_frames(frames, processes=8):
+                        print(path)
+'''
+import argparse
+import json
+import os
+import sys
+from collections import namedtuple
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+import numpy as np
+
+CACHE_DIR = os.environ.get('SKY_MAP_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'sky_map'))
+EPHEMERIS = 'de421.bsp'
+CATALOG_COLUMNS = ('magnitude', 'ra_degrees', 'ra_hours', 'dec_degrees', 'ra_mas_per_year', 'dec_mas_per_year', 'parallax_mas',
+                   'epoch_year')  #columns of the Hipparcos dataframe needed to place and draw a star
+TIME_FORMAT = '%Y-%m-%d %H:%M'
+
+Location = namedtuple('Location', 'name latitude longitude timezone')
+Frame = namedtuple('Frame', 'latitude longitude utc path')  #one chart: where, when (timezone-aware UTC datetime) and the image file
+
+_tz_finder = None  #tzwhere instance, built on the first timezone lookup that misses the cache
+_worker_renderer = None  #renderer held by each worker process, set once by _init_worker()
+
+
+def load_catalog(limiting_magnitude=10, cache_dir=CACHE_DIR):
+    """Returns the stars no fainter than limiting_magnitude as {column: array}, with the arrays memory-mapped from the cache.
+       On the first call for a magnitude limit the Hipparcos catalog is parsed, cut and saved one column per .npy file.
+    """
+    directory = os.path.join(cache_dir, 'hipparcos_mag{:g}'.format(limiting_magnitude))
+    if not os.path.isdir(directory):
+        _save_catalog(directory, limiting_magnitude, cache_dir)
+    return {column: np.load(os.path.join(directory, column + '.npy'), mmap_mode='r') for column in CATALOG_COLUMNS}
+
+
+def _save_catalog(directory, limiting_magnitude, cache_dir):
+    """Parses the Hipparcos catalog, keeps the stars with a position and magnitude up to the limit and saves their columns."""
+    from skyfield.api import Loader
+    from skyfield.data import hipparcos
+
+    with Loader(cache_dir).open(hipparcos.URL) as handle:
+        stars = hipparcos.load_dataframe(handle)
+    stars = stars[stars['ra_degrees'].notnull() & (stars['magnitude'] <= limiting_magnitude)]
+    partial = directory + '.{}.tmp'.format(os.getpid())  #renamed when complete, so other processes never see half a catalog
+    os.makedirs(partial)
+    for column in CATALOG_COLUMNS:
+        np.save(os.path.join(partial, column + '.npy'), stars[column].to_numpy(dtype=np.float64))
+    try:
+        os.rename(partial, directory)
+    except OSError:  #another process saved the same catalog first
+        for column in CATALOG_COLUMNS:
+            os.remove(os.path.join(partial, column + '.npy'))
+        os.rmdir(partial)
+
+
+def resolve_location(name, cache_dir=CACHE_DIR):
+    """Returns the Location of a place name, geocoding it and finding its timezone only if it is not in the cache yet."""
+    path = os.path.join(cache_dir, 'locations.json')
+    try:
+        with open(path) as handle:
+            known = json.load(handle)
+    except FileNotFoundError:
+        known = {}
+    if name not in known:
+        from geopy import Nominatim
+
+        place = Nominatim(user_agent='myGeocoder').geocode(name)
+        if place is None:
+            raise ValueError('Location not found: {}'.format(name))
+        known[name] = {'latitude': place.latitude, 'longitude': place.longitude,
+                       'timezone': timezone_at(place.latitude, place.longitude)}
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path + '.tmp', 'w') as handle:
+            json.dump(known, handle, indent=2)
+        os.replace(path + '.tmp', path)
+    return Location(name, known[name]['latitude'], known[name]['longitude'], known[name]['timezone'])
+
+
+def timezone_at(latitude, longitude):
+    """Returns the name of the timezone at a point, building the tzwhere index on first use."""
+    global _tz_finder
+    if _tz_finder is None:
+        from tzwhere import tzwhere
+
+        _tz_finder = tzwhere.tzwhere()
+    name = _tz_finder.tzNameAt(latitude, longitude)
+    if name is None:
+        raise ValueError('No timezone found at {}, {}.'.format(latitude, longitude))
+    return name
+
+
+def to_utc(location, when):
+    """Converts a local time of the location, given as a 'YYYY-MM-DD HH:MM' string or naive datetime, to a UTC datetime."""
+    from pytz import timezone, utc
+
+    if isinstance(when, str):
+        when = datetime.strptime(when, TIME_FORMAT)
+    return timezone(location.timezone).localize(when, is_dst=None).astimezone(utc)
+
+
+def time_lapse(location, start, end, step, directory, pattern='frame_{:05d}.png'):
+    """Returns the frames of a location from UTC start to end (included) every step, with image files numbered in directory."""
+    if step <= timedelta(0):
+        raise ValueError('The step between frames must be positive.')
+    frames = []
+    utc = start
+    while utc <= end:
+        frames.append(Frame(location.latitude, location.longitude, utc, os.path.join(directory, pattern.format(len(frames)))))
+        utc += step
+    return frames
+
+
+class SkyMapRenderer:
+    """Draws sky charts of the stars no fainter than limiting_magnitude, reusing the ephemeris, catalog and figure for every frame."""
+    def __init__(self, limiting_magnitude=10, chart_size=10, max_star_size=100, dpi=100, cache_dir=CACHE_DIR):
+        import pandas as pd
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        from matplotlib.patches import Circle
+        from skyfield.api import Loader, Star
+
+        loader = Loader(cache_dir)
+        self.earth = loader(EPHEMERIS)['earth']
+        self.timescale = loader.timescale()
+        catalog = load_catalog(limiting_magnitude, cache_dir)
+        self.stars = Star.from_dataframe(pd.DataFrame(catalog, copy=False))  #all stars as one vectorized Star
+        self.sizes = max_star_size * 10 ** (catalog['magnitude'] / -2.5)  #marker size of every star, from its magnitude
+        self.dpi = dpi
+
+        self.figure = Figure(figsize=(chart_size, chart_size))  #no pyplot, so no window and no global figure state
+        FigureCanvasAgg(self.figure)
+        ax = self.figure.subplots()
+        ax.add_patch(Circle((0, 0), 1, color='navy', fill=True))
+        self.points = ax.scatter(np.empty(0), np.empty(0), s=np.empty(0), color='white', marker='.', linewidths=0, zorder=2)
+        self.points.set_clip_path(Circle((0, 0), radius=1, transform=ax.transData))
+        ax.set_xlim(-1, 1)
+        ax.set_ylim(-1, 1)
+        ax.axis('off')
+
+    def project(self, latitude, longitude, utc):
+        """Returns the x and y chart coordinates of every star, seen looking straight up from the location at the UTC time."""
+        from skyfield.api import Star, wgs84
+        from skyfield.projections import build_stereographic_projection
+
+        t = self.timescale.from_datetime(utc)
+        earth = self.earth.at(t)
+        ra, dec, _ = wgs84.latlon(latitude_degrees=latitude, longitude_degrees=longitude).at(t).radec()
+        projection = build_stereographic_projection(earth.observe(Star(ra=ra, dec=dec)))  #centred on the zenith
+        return projection(earth.observe(self.stars))
+
+    def render(self, frame):
+        """Draws one frame and saves it to frame.path; returns the path."""
+        x, y = self.project(frame.latitude, frame.longitude, frame.utc)
+        visible = x * x + y * y <= 1  #stars below the horizon fall outside the chart and are not drawn
+        self.points.set_offsets(np.column_stack((x[visible], y[visible])))
+        self.points.set_sizes(self.sizes[visible])
+        directory = os.path.dirname(frame.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.figure.savefig(frame.path, dpi=self.dpi)
+        return frame.path
+
+
+def _init_worker(options):
+    """Builds the renderer in the worker process, so the ephemeris and catalog are loaded once per worker."""
+    global _worker_renderer
+    _worker_renderer = SkyMapRenderer(**options)
+
+
+def _render_in_worker(frame):
+    """Renders one frame with the renderer of this worker."""
+    return _worker_renderer.render(frame)
+
+
+def render_frames(frames, processes=None, chunksize=8, **options):
+    """Yields the image path of every frame as it is written, in any order; options are the arguments of SkyMapRenderer.
+       processes is the size of the worker pool (default: number of CPUs); with processes=1 frames are rendered in this process.
+    """
+    if processes == 1:
+        renderer = SkyMapRenderer(**options)
+        for frame in frames:
+            yield renderer.render(frame)
+        return
+    from skyfield.api import Loader
+
+    cache_dir = options.get('cache_dir', CACHE_DIR)
+    Loader(cache_dir)(EPHEMERIS)  #downloads and caches here, so that the workers only read the cache
+    load_catalog(options.get('limiting_magnitude', 10), cache_dir)
+    with Pool(processes or os.cpu_count(), initializer=_init_worker, initargs=(options,)) as pool:
+        yield from pool.imap_unordered(_render_in_worker, frames, chunksize)
+
+
+def main(argv=None):
+    """Command line entry point: renders a time-lapse of the sky above one place."""
+    parser = argparse.ArgumentParser(description='Render sky charts of one place over a range of local times.')
+    parser.add_argument('location', help='place name, ex. "Times Square, New York, NY"')
+    parser.add_argument('start', help='local time of the first frame, as YYYY-MM-DD HH:MM')
+    parser.add_argument('--end', help='local time of the last frame (default: only the start frame)')
+    parser.add_argument('--step', type=float, default=60, help='minutes between frames (default: 60)')
+    parser.add_argument('-o', '--output', default='frames', help='directory for the images (default: frames)')
+    parser.add_argument('-p', '--processes', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--magnitude', type=float, default=10, help='faintest magnitude drawn (default: 10)')
+    parser.add_argument('--size', type=float, default=10, help='chart size in inches (default: 10)')
+    parser.add_argument('--dpi', type=int, default=100, help='image resolution (default: 100)')
+    parser.add_argument('--cache', default=CACHE_DIR, help='cache directory (default: {})'.format(CACHE_DIR))
+    args = parser.parse_args(argv)
+
+    location = resolve_location(args.location, args.cache)
+    start = to_utc(location, args.start)
+    end = to_utc(location, args.end) if args.end else start
+    frames = time_lapse(location, start, end, timedelta(minutes=args.step), args.output)
+    for count, path in enumerate(render_frames(frames, args.processes, limiting_magnitude=args.magnitude, chart_size=args.size,
+                                               dpi=args.dpi, cache_dir=args.cache), 1):
+        print('{}/{} {}'.format(count, len(frames), path), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+'''Checks that memory-mapped FASTA and .2bit files yield every record, in file order, when record names repeat or are empty.
+Run with: python -m pytest -q test_hmm_viterbi_ingest.py
+'''
+import struct
+
+import numpy as np
+
+from hidden_markov_model_viterbi_E5I import encode_sequence
+from hmm_viterbi_ingest import TWO_BIT_BASES, TWO_BIT_SIGNATURE, open_sequences
+
+RECORDS = [('a', 'TATAT'), ('a', 'TATATAT'), ('', 'TAT'), ('', 'TATTT')]
+
+
+def write_two_bit(path, records):
+    """Writes records without N blocks as a little-endian .2bit file."""
+    index_size = sum(5 + len(name) for name, _ in records)
+    index, body = b'', b''
+    for name, sequence in records:
+        index += bytes([len(name)]) + name.encode() + struct.pack('<I', 16 + index_size + len(body))
+        values = [TWO_BIT_BASES.index(base.encode()) for base in sequence] + [0] * (-len(sequence) % 4)
+        packed = bytes((values[k] << 6) | (values[k + 1] << 4) | (values[k + 2] << 2) | values[k + 3] for k in range(0, len(values), 4))
+        body += struct.pack('<IIII', len(sequence), 0, 0, 0) + packed  #length, no N blocks, no lower case blocks, reserved word
+    path.write_bytes(struct.pack('<IIII', TWO_BIT_SIGNATURE, 0, len(records), 0) + index + body)
+
+
+def assert_every_record(path):
+    with open_sequences(str(path)) as sequences:
+        assert len(sequences) == len(RECORDS)
+        assert sequences.names == [name for name, _ in RECORDS]
+        for (name, codes), (expected_name, sequence) in zip(sequences, RECORDS):
+            assert name == expected_name
+            assert np.array_equal(codes, encode_sequence(sequence))
+        assert np.array_equal(sequences['a'], encode_sequence('TATAT'))  #the first record of a repeated name
+
+
+def test_fasta_duplicate_and_empty_names(tmp_path):
+    path = tmp_path / 'records.fa'
+    path.write_text(''.join('>{}\n{}\n'.format(name, sequence) for name, sequence in RECORDS))
+    assert_every_record(path)
+
+
+def test_two_bit_duplicate_and_empty_names(tmp_path):
+    path = tmp_path / 'records.2bit'
+    write_two_bit(path, RECORDS)
+    assert_every_record(path)
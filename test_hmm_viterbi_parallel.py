@@ -0,0 +1,59 @@
+'''Randomized check that ViterbiModel.decode_parallel() finds the same path as ViterbiModel.decode().
+Run with: python -m pytest -q test_hmm_viterbi_parallel.py
+
+Blocks are made small so that short sequences are cut into many chunks; the worker processes are forked so that they see the
+smaller block size. Tie-prone Exon, 5', Intron parameters (powers of two) and random graphs with cycles are both covered.
+'''
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import hidden_markov_model_viterbi_E5I as hmm
+
+TIE_PRONE = [0.5, 0.25, 0.125, 0.75]
+EMISSIONS = [[0.25] * 4, [0.5, 0.25, 0.125, 0.125], [0.5, 0.5, 0, 0]]
+
+
+@pytest.fixture(scope='module')
+def pool():
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        pytest.skip('needs forked worker processes to share the small block size')
+    with multiprocessing.get_context('fork').Pool(2) as pool:
+        yield pool
+
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(hmm, 'BLOCK_SIZE', 64)
+
+
+def assert_same_result(model, codes, chunks, pool):
+    serial = model.decode(codes)
+    parallel = model.decode_parallel(codes, chunks=chunks, pool=pool)
+    if serial.path is None:
+        assert parallel.path is None
+    else:
+        assert np.array_equal(parallel.path, serial.path)
+        assert np.isclose(parallel.log_probability, serial.log_probability)
+
+
+def test_e5i_with_ties(pool):
+    rng = np.random.default_rng(1)
+    for _ in range(300):
+        emissions = {state: dict(zip('ACGT', EMISSIONS[rng.integers(len(EMISSIONS))])) for state in ('Exon', '5 Prime', 'Intron')}
+        model = hmm.ViterbiModel.from_e5i(*rng.choice(TIE_PRONE, 3), emissions)
+        codes = rng.integers(0, 4, rng.integers(1, 1000)).astype(np.uint8)
+        assert_same_result(model, codes, int(rng.integers(2, 9)), pool)
+
+
+def test_cyclic_graphs(pool):
+    rng = np.random.default_rng(2)
+    for _ in range(150):
+        count = int(rng.integers(2, 6))
+        transitions = rng.choice(TIE_PRONE, (count, count)) * (rng.random((count, count)) > 0.4)
+        emissions = rng.choice(TIE_PRONE, (count, 4)) * (rng.random((count, 4)) > 0.2)
+        model = hmm.ViterbiModel.from_matrix(['s{}'.format(q) for q in range(count)], transitions, emissions, np.ones(count),
+                                             rng.random(count) > 0.5)
+        codes = rng.integers(0, 4, rng.integers(1, 1000)).astype(np.uint8)
+        assert_same_result(model, codes, int(rng.integers(2, 9)), pool)